@@ -0,0 +1,280 @@
+"""Batch harmonization of progressions read from JSONL
+
+Each input line is a JSON object describing one progression:
+
+    {"id": "ex1", "numerals": ["I", "IV", "V", "I"], "key": "E",
+     "parts": ["s", "a", "t", "b"], "ranges": {"s": ["G4", "G5"], ...}}
+
+Only numerals is required. key is a key name as music21 writes them ('E'
+for E major, 'e' for E minor) and defaults to C major; parts and ranges default to
+those of SimpleHarmonizerCSP. Each output line has the id, the solution as
+{variable : note name} (null if there is none), solve statistics and, if
+the progression could not be solved, the error. A line that is not a JSON
+object gets an output line with a null id, its line number and the error.
+
+The progressions are solved by a pool of worker processes that each keep
+their voicing tables, and the input is read lazily, with a bounded number
+of progressions in flight.
+
+Usage:
+    python batch.py progressions.jsonl -o solutions.jsonl --workers 8
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from csp import DEFAULT_RANGES, SimpleHarmonizerCSP
+from pitches import parse_note_value
+from solutions import SolutionCache
+from ordering import VALUE_ORDERINGS, VARIABLE_ORDERINGS
+from solver import ACSolver, ChainSolver
+from theory import Key
+from transposition import KeyNormalizer
+
+SOLVERS = ('chain', 'split')
+
+# The SolutionCache of each cache file opened in this process
+_solution_caches = {}
+
+
+class InvalidLine(dict):
+    """The output record of an input line that is not a JSON object"""
+    def __init__(self, line: int, error: str):
+        super().__init__(id=None, line=line, solution=None, error=error)
+
+
+def build_csp(record: dict) -> SimpleHarmonizerCSP:
+    """Builds the CSP described by an input record"""
+    numerals = record['numerals']
+    kwargs = {}
+    if 'parts' in record:
+        kwargs['part_list'] = list(record['parts'])
+    if 'ranges' in record:
+        # The parts without a range keep the default one
+        kwargs['ranges'] = dict(DEFAULT_RANGES)
+        kwargs['ranges'].update(
+            (p, tuple(parse_note_value(n) for n in r))
+            for p, r in record['ranges'].items())
+    return SimpleHarmonizerCSP(name=str(record.get('id', 'batch')),
+                               notes=len(numerals),
+                               numerals=numerals,
+                               key=Key(record.get('key', 'C')),
+                               **kwargs)
+
+
+def solution_cache(path: str) -> SolutionCache:
+    """Returns this process's SolutionCache for a file"""
+    if path not in _solution_caches:
+        _solution_caches[path] = SolutionCache(path)
+    return _solution_caches[path]
+
+
+def solve_function(solver: str, stats: dict, orderings=('input', 'pitch')):
+    """Returns a function solving a CSP with solver, adding to stats
+
+    orderings are the names of the variable and value orderings of the
+    split solver (see ordering.py).
+    """
+    def solve(csp):
+        if solver == 'chain':
+            chain = ChainSolver(csp)
+            solution = chain.solve()
+            counts = {'checks': chain.checks}
+        else:
+            ac = ACSolver(csp, VARIABLE_ORDERINGS[orderings[0]],
+                          VALUE_ORDERINGS[orderings[1]])
+            solution = ac.domain_splitting()
+            counts = ac.stats
+        for name, count in counts.items():
+            if isinstance(count, int):
+                stats[name] = stats.get(name, 0) + count
+            else:
+                stats[name] = count
+        return solution
+
+    return solve
+
+
+def harmonize(record: dict,
+              solver='chain',
+              cache=None,
+              normalize=False,
+              orderings=('input', 'pitch')) -> dict:
+    """Solves one input record and returns its output record
+
+    Args:
+        record: A dictionary parsed from an input line
+        solver: 'chain' for ChainSolver or 'split' for ACSolver's domain
+            splitting
+        cache: The file of a SolutionCache to look the solution up in and
+            store it to, or None
+        normalize: Whether to solve the progression in the canonical key
+            and transpose the solution (see transposition.KeyNormalizer)
+        orderings: The names of the variable and value orderings of the
+            split solver
+
+    Returns:
+        A dictionary with the id, the solution, the stats and, on failure,
+        the error
+    """
+    if not isinstance(record, dict):
+        return {
+            'id': None,
+            'solution': None,
+            'error': f'TypeError: a record must be a JSON object, '
+                     f'not {type(record).__name__}'
+        }
+    result = {'id': record.get('id'), 'solution': None}
+    start = time.perf_counter()
+    try:
+        csp = build_csp(record)
+        built = time.perf_counter()
+        stats = {'solver': solver, 'build_seconds': built - start}
+        solve = solve_function(solver, stats, orderings)
+        solutions = None if cache is None else solution_cache(cache)
+        if solutions is not None:
+            hits = solutions.hits
+        if normalize:
+            normalizer = KeyNormalizer(solve, solutions)
+            solution = normalizer.solve(csp)
+            stats['transposed'] = normalizer.transposed > 0
+        elif solutions is not None:
+            solution = solutions.solve(csp, solve)
+        else:
+            solution = solve(csp)
+        if solutions is not None:
+            stats['cached'] = solutions.hits > hits
+        stats['solve_seconds'] = time.perf_counter() - built
+        result['stats'] = stats
+        if solution:
+            result['solution'] = {
+                var: solution[var].nameWithOctave
+                for var in csp.variables
+            }
+    except Exception as e:
+        result['error'] = f'{type(e).__name__}: {e}'
+    return result
+
+
+def read_records(lines):
+    """Yields the records of the non-empty lines of a JSONL stream
+
+    A line that is not a JSON object is yielded as an InvalidLine, which
+    harmonize_stream passes through as its output record.
+    """
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            yield InvalidLine(n, f'JSONDecodeError: {e}')
+            continue
+        if isinstance(record, dict):
+            yield record
+        else:
+            yield InvalidLine(
+                n, f'TypeError: a record must be a JSON object, '
+                f'not {type(record).__name__}')
+
+
+def harmonize_stream(records,
+                     solver='chain',
+                     workers=None,
+                     window=None,
+                     cache=None,
+                     normalize=False,
+                     orderings=('input', 'pitch')):
+    """Solves records on a process pool, yielding results in input order
+
+    Args:
+        records: An iterable of input records, consumed lazily
+        solver: The solver to use (see harmonize)
+        workers: The number of processes (os.cpu_count() by default, 0 to
+            solve in this process)
+        window: The maximum number of records in flight (4 per worker by
+            default)
+        cache: The file of a SolutionCache shared by the workers, or None
+        normalize: Whether to solve in the canonical key (see harmonize)
+        orderings: The orderings of the split solver (see harmonize)
+
+    Yields:
+        Output records
+    """
+    if workers == 0:
+        for record in records:
+            if isinstance(record, InvalidLine):
+                yield record
+            else:
+                yield harmonize(record, solver, cache, normalize, orderings)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    window = window or 4 * workers
+    pending = deque()
+    with ProcessPoolExecutor(workers) as pool:
+        for record in records:
+            if isinstance(record, InvalidLine):
+                future = Future()
+                future.set_result(record)
+            else:
+                future = pool.submit(harmonize, record, solver, cache,
+                                     normalize, orderings)
+            pending.append(future)
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description='Harmonize progressions read from a JSONL file')
+    parser.add_argument('input', help='Input JSONL file, or - for stdin')
+    parser.add_argument('-o',
+                        '--output',
+                        default='-',
+                        help='Output JSONL file, or - for stdout')
+    parser.add_argument('--solver', choices=SOLVERS, default='chain')
+    parser.add_argument('--workers',
+                        type=int,
+                        default=None,
+                        help='Number of processes (0 to solve in-process)')
+    parser.add_argument('--cache',
+                        default=None,
+                        help='SQLite file to cache the solutions in')
+    parser.add_argument('--normalize',
+                        action='store_true',
+                        help='Solve in C and transpose to the key')
+    parser.add_argument('--variable-ordering',
+                        choices=VARIABLE_ORDERINGS,
+                        default='input')
+    parser.add_argument('--value-ordering',
+                        choices=VALUE_ORDERINGS,
+                        default='pitch')
+    args = parser.parse_args(argv)
+
+    infile = sys.stdin if args.input == '-' else open(args.input)
+    outfile = sys.stdout if args.output == '-' else open(args.output, 'w')
+    try:
+        for result in harmonize_stream(read_records(infile), args.solver,
+                                       args.workers,
+                                       cache=args.cache,
+                                       normalize=args.normalize,
+                                       orderings=(args.variable_ordering,
+                                                  args.value_ordering)):
+            outfile.write(json.dumps(result) + '\n')
+            outfile.flush()
+    finally:
+        if infile is not sys.stdin:
+            infile.close()
+        if outfile is not sys.stdout:
+            outfile.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,76 @@
-from music21.chord import Chord
-from music21.roman import romanNumeralFromChord, RomanNumeral
-from music21.voiceLeading import VoiceLeadingQuartet
-from music21.key import Key
+import sys
+from collections import OrderedDict
+from pitches import shared_note
+from theory import Numeral, roman_figure
+from voiceleading import parallel_fifth, parallel_octave
+
+# Version of the rules below. Bump it whenever a change to a condition can
+# change which harmonizations are valid, so that stored solutions are not
+# reused (see solutions.SolutionCache)
+CONSTRAINT_SET_VERSION = 2
+
+
+class EvaluationCache:
+    """A bounded LRU cache of the results of constraint conditions
+
+    Entries are keyed by the condition object and the tuple of values it was
+    evaluated on, so one cache can be shared by all constraints of a CSP.
+    Only use it with conditions that are pure (all conditions in this module
+    are).
+
+    Attributes:
+        max_bytes: The approximate memory the entries may take up
+        nbytes: The approximate memory the entries take up now
+        hits: The number of evaluations answered from the cache
+        misses: The number of evaluations that called the condition
+        evictions: The number of entries dropped to stay under max_bytes
+    """
+    # Approximate cost of one OrderedDict entry on top of its key
+    ENTRY_OVERHEAD = 100
+
+    def __init__(self, max_bytes=64 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def evaluate(self, condition, values: tuple) -> bool:
+        """Returns condition(*values), from the cache if possible"""
+        key = (condition, values)
+        entries = self._entries
+        result = entries.get(key)
+        if result is not None:
+            self.hits += 1
+            entries.move_to_end(key)
+            return result
+
+        self.misses += 1
+        result = bool(condition(*values))
+        entries[key] = result
+        self.nbytes += self.entry_size(key)
+        while self.nbytes > self.max_bytes and entries:
+            old_key, _ = entries.popitem(last=False)
+            self.nbytes -= self.entry_size(old_key)
+            self.evictions += 1
+        return result
+
+    def entry_size(self, key) -> int:
+        return sys.getsizeof(key) + sys.getsizeof(key[1]) + self.ENTRY_OVERHEAD
+
+    def clear(self):
+        """Drops all entries (the counters are kept)"""
+        self._entries.clear()
+        self.nbytes = 0
 
 
 class Constraint:
@@ -10,11 +79,16 @@ class Constraint:
     Attributes:
         scope: A tuple of variables
         condition: A function that can applied to a tuple of values
-            for the variables. It should return a boolean.
+            for the variables. It should return a boolean. It may have a
+            partial attribute: a function taking the same arguments, with
+            None for the variables that are not assigned yet, that returns
+            False only if no assignment of them can satisfy condition.
+        cache: An optional EvaluationCache for the results of condition
     """
-    def __init__(self, scope, condition):
+    def __init__(self, scope, condition, cache=None):
         self.scope = scope
         self.condition = condition
+        self.cache = cache
 
     def __repr__(self):
         return self.condition.__name__ + str(self.scope)
@@ -24,12 +98,34 @@ class Constraint:
 
         precondition: all variables are assigned in assignment
         """
-        return self.condition(*tuple(assignment[v] for v in self.scope))
+        values = tuple(assignment[v] for v in self.scope)
+        if self.cache is None:
+            return self.condition(*values)
+        return self.cache.evaluate(self.condition, values)
+
+    @property
+    def partial(self):
+        """The partial check of the condition, or None"""
+        return getattr(self.condition, 'partial', None)
+
+    def partial_holds(self, assignment) -> bool:
+        """Returns False if no extension of assignment can satisfy the constraint
+
+        Variables of the scope missing from assignment are unassigned.
+        Without a partial check on the condition this is always True.
+        """
+        partial = self.partial
+        if partial is None:
+            return True
+        return partial(*(assignment.get(v) for v in self.scope))
 
 
 def no_parallel_fifths(*notes) -> bool:
     """Assert that there are no parallel fifths between all voices.
 
+    Uses the integer kernel in voiceleading. no_parallel_fifths_m21 is the
+    music21 reference it is tested against.
+
     Args:
         notes: A tuple in the form of (s1, a1, t1, b1, s2, a2, t2, b2) where the first
             note voices come first and the second ones last
@@ -38,25 +134,108 @@ def no_parallel_fifths(*notes) -> bool:
     notes2 = notes[len(notes) // 2:]
     for n1 in range(len(notes1) - 1):
         for n2 in range(len(notes2) - 1):
-            if VoiceLeadingQuartet(notes1[n1], notes2[n2], notes1[n1 + 1],
-                                   notes2[n2 + 1]).parallelFifth():
+            if parallel_fifth(notes1[n1], notes2[n2], notes1[n1 + 1],
+                              notes2[n2 + 1]):
                 return False
     return True
 
 
 def no_parallel_octaves(*notes) -> bool:
-    """Assert that there are no parallel fifths between all voices
+    """Assert that there are no parallel octaves between all voices
+
+    Uses the integer kernel in voiceleading. no_parallel_octaves_m21 is the
+    music21 reference it is tested against.
+
+    Args:
+        notes: A tuple in the form of (s1, a1, t1, b1, s2, a2, t2, b2) where the first
+            note voices come first and the second ones last
+    """
+    notes1 = notes[:len(notes) // 2]
+    notes2 = notes[len(notes) // 2:]
+    for n1 in range(len(notes1) - 1):
+        for n2 in range(len(notes2) - 1):
+            if parallel_octave(notes1[n1], notes2[n2], notes1[n1 + 1],
+                               notes2[n2 + 1]):
+                return False
+    return True
+
+
+def _no_parallel_partial(parallel):
+    """Returns a partial check of the quartets that are fully assigned"""
+    def partial(*notes) -> bool:
+        notes1 = notes[:len(notes) // 2]
+        notes2 = notes[len(notes) // 2:]
+        for n1 in range(len(notes1) - 1):
+            for n2 in range(len(notes2) - 1):
+                quartet = (notes1[n1], notes2[n2], notes1[n1 + 1],
+                           notes2[n2 + 1])
+                if None not in quartet and parallel(*quartet):
+                    return False
+        return True
+
+    return partial
+
+
+no_parallel_fifths.partial = _no_parallel_partial(parallel_fifth)
+no_parallel_octaves.partial = _no_parallel_partial(parallel_octave)
+
+
+def no_parallel_fifths_quartet(u1, l1, u2, l2) -> bool:
+    """Assert that there are no parallel fifths in one quartet of two beats.
+
+    Args:
+        u1, l1: Upper and lower note on the first beat
+        u2, l2: Upper and lower note on the second beat
+    """
+    return not parallel_fifth(u1, u2, l1, l2)
+
+
+def no_parallel_octaves_quartet(u1, l1, u2, l2) -> bool:
+    """Assert that there are no parallel octaves in one quartet of two beats.
+
+    Args:
+        u1, l1: Upper and lower note on the first beat
+        u2, l2: Upper and lower note on the second beat
+    """
+    return not parallel_octave(u1, u2, l1, l2)
+
+
+def no_parallel_fifths_m21(*notes) -> bool:
+    """Assert that there are no parallel fifths between all voices (music21 reference)
+
+    Args:
+        notes: A tuple in the form of (s1, a1, t1, b1, s2, a2, t2, b2) where the first
+            note voices come first and the second ones last
+    """
+    from music21.voiceLeading import VoiceLeadingQuartet
+    notes1 = notes[:len(notes) // 2]
+    notes2 = notes[len(notes) // 2:]
+    for n1 in range(len(notes1) - 1):
+        for n2 in range(len(notes2) - 1):
+            if VoiceLeadingQuartet(shared_note(notes1[n1]),
+                                   shared_note(notes2[n2]),
+                                   shared_note(notes1[n1 + 1]),
+                                   shared_note(notes2[n2 + 1])).parallelFifth():
+                return False
+    return True
+
+
+def no_parallel_octaves_m21(*notes) -> bool:
+    """Assert that there are no parallel octaves between all voices (music21 reference)
 
     Args:
         notes: A tuple in the form of (s1, a1, t1, b1, s2, a2, t2, b2) where the first
             note voices come first and the second ones last
     """
+    from music21.voiceLeading import VoiceLeadingQuartet
     notes1 = notes[:len(notes) // 2]
     notes2 = notes[len(notes) // 2:]
     for n1 in range(len(notes1) - 1):
         for n2 in range(len(notes2) - 1):
-            if VoiceLeadingQuartet(notes1[n1], notes2[n2], notes1[n1 + 1],
-                                   notes2[n2 + 1]).parallelOctave():
+            if VoiceLeadingQuartet(shared_note(notes1[n1]),
+                                   shared_note(notes2[n2]),
+                                   shared_note(notes1[n1 + 1]),
+                                   shared_note(notes2[n2 + 1])).parallelOctave():
                 return False
     return True
 
@@ -70,21 +249,28 @@ def different_notes(n1, n2) -> bool:
     """
     return n1 != n2
 
-def require_root_and_third(rn: RomanNumeral):
+def require_root_and_third(rn: Numeral):
     """Assert that the root and the third are in the chord"""
-    root = rn.root()
+    root = rn.root
     third = rn.third
     
     def mandate_root_and_third(*notes) -> bool:
         root_found = False
         third_found = False
         for n in notes:
-            if root.name == n.name:
+            if root == n.name:
                 root_found = True
-            if third.name == n.name:
+            if third == n.name:
                 third_found = True
         return root_found and third_found
 
+    def partial(*notes) -> bool:
+        # The unassigned notes must be enough for what is still missing
+        names = {n.name for n in notes if n is not None}
+        missing = (root not in names) + (third not in names)
+        return missing <= notes.count(None)
+
+    mandate_root_and_third.partial = partial
     return mandate_root_and_third
 
 
@@ -97,6 +283,14 @@ def all_notes_different_one_beat(*notes) -> bool:
     return len(notes) == len(set(notes))
 
 
+def _all_notes_different_partial(*notes) -> bool:
+    assigned = [n for n in notes if n is not None]
+    return len(assigned) == len(set(assigned))
+
+
+all_notes_different_one_beat.partial = _all_notes_different_partial
+
+
 # TODO: Fix this constraint
 def maximum_two_same_note_name(*notes) -> bool:
     """Asserts that all the notes in each part are different on one beat.
@@ -123,33 +317,175 @@ def assert_is_pac(key):
         - First chord is root position V
         - Second chord is root position I
         - Top voice is tonic in second chord
+
+    The chords are named by theory.roman_figure, which names every voicing
+    of a chord alike. music21 marks the third of some voicings against the
+    key signature instead ('V#3' for a major dominant in a minor key, 'ib3'
+    for a minor tonic in a major key), so unlike with music21 every voicing
+    of those chords passes (see test_theory.MUSIC21_MARKED_THIRDS).
     
     Args:
         notes: A tuple of notes formatted like (s1, a1, t1, b1, s2, a2, t2, b2)
             in all parts
     """
+    def pac_dominant(*notes) -> bool:
+        """The chord of the first beat is a root position V or V7"""
+        return roman_figure(notes, key) in ('V', 'V7')
+
+    def pac_tonic(*notes) -> bool:
+        """The chord of the second beat is a root position I with the tonic on top"""
+        tonic = key.tonic.name
+        # Check for correct notes in bottom and top
+        if notes[-1].name != tonic or notes[0].name != tonic:
+            return False
+        return roman_figure(notes, key) in ('I', 'i')
+
     def is_pac(*notes) -> bool:
         notes1 = notes[:len(notes) // 2]
         notes2 = notes[len(notes) // 2:]
-        b1 = notes1[-1]
-        b2 = notes2[-1]
-        s1 = notes1[0]
-        s2 = notes2[0]
+        return pac_tonic(*notes2) and pac_dominant(*notes1)
+
+    def partial(*notes) -> bool:
+        """The top and bottom notes of the second beat are the tonic"""
         tonic = key.tonic.name
-        # Check for correct notes in bottom and top
-        if b2.name != tonic or s2.name != tonic:
-            return False
+        notes2 = notes[len(notes) // 2:]
+        return all(n is None or n.name == tonic for n in (notes2[0], notes2[-1]))
 
-        # Check for correct chord types
-        c1 = Chord(notes1)
-        c2 = Chord(notes2)
-        rn1 = romanNumeralFromChord(c1, key)
-        rn2 = romanNumeralFromChord(c2, key)
-        if rn1.figure != 'V' and rn1.figure != 'V7':
-            return False
-        if rn2.figure != 'I' and rn2.figure != 'i':
-            return False
+    # is_pac is a conjunction of one condition per beat, which lets it be
+    # checked once per voicing instead of once per pair of voicings
+    is_pac.beat_conditions = (pac_dominant, pac_tonic)
+    is_pac.partial = partial
+    return is_pac
 
-        return True
 
-    return is_pac
\ No newline at end of file
+# Two-beat conditions that are a conjunction over quartets, mapped to the
+# condition of one quartet
+QUARTET_DECOMPOSITIONS = {
+    no_parallel_fifths: no_parallel_fifths_quartet,
+    no_parallel_octaves: no_parallel_octaves_quartet,
+}
+
+
+def decompose(constraints: list) -> list:
+    """Rewrites two-beat voice-leading constraints into quartet constraints
+
+    A constraint like no_parallel_fifths over (s1, a1, t1, b1, s2, a2, t2, b2)
+    checks the quartets (notes1[i], notes1[i + 1], notes2[j], notes2[j + 1])
+    for every i and j, so it is replaced by one 4-ary constraint per quartet.
+    Support for a value then only has to be searched over three other
+    variables. Other constraints are left as they are.
+
+    Args:
+        constraints: A list of constraints
+
+    Returns:
+        A new list of constraints
+    """
+    decomposed = []
+    for con in constraints:
+        quartet = QUARTET_DECOMPOSITIONS.get(con.condition)
+        if quartet is None:
+            decomposed.append(con)
+            continue
+        scope1 = con.scope[:len(con.scope) // 2]
+        scope2 = con.scope[len(con.scope) // 2:]
+        for i in range(len(scope1) - 1):
+            for j in range(len(scope2) - 1):
+                decomposed.append(
+                    Constraint((scope1[i], scope1[i + 1], scope2[j],
+                                scope2[j + 1]), quartet, con.cache))
+    return decomposed
+
+
+class Conjunction:
+    """A condition that holds when all of its conditions hold
+
+    Conjunctions of the same conditions are equal, so an EvaluationCache
+    shares their results between constraints.
+
+    Attributes:
+        conditions: The tuple of conditions, checked in order
+        partial: The conjunction of the partial checks of the conditions
+            that have one, or None if none has
+    """
+    def __init__(self, conditions):
+        self.conditions = tuple(conditions)
+        self.__name__ = ' & '.join(c.__name__ for c in self.conditions)
+        partials = [
+            c.partial for c in self.conditions
+            if getattr(c, 'partial', None) is not None
+        ]
+        self.partial = None
+        if partials:
+            self.partial = lambda *notes: all(p(*notes) for p in partials)
+
+    def __call__(self, *notes) -> bool:
+        return all(condition(*notes) for condition in self.conditions)
+
+    def __eq__(self, other):
+        return isinstance(other, Conjunction) and \
+            self.conditions == other.conditions
+
+    def __hash__(self):
+        return hash(self.conditions)
+
+
+def rule_names(con) -> tuple:
+    """Returns the names of the conditions a constraint checks"""
+    conditions = getattr(con.condition, 'conditions', (con.condition, ))
+    return tuple(c.__name__ for c in conditions)
+
+
+def split_rule(con, name: str) -> tuple:
+    """Splits the condition with a name out of a (possibly fused) constraint
+
+    Args:
+        con: A constraint
+        name: The name of the condition, like 'is_pac'
+
+    Returns:
+        A tuple of the constraint checking the other conditions and the
+        constraint checking the named one, each None if there is none
+    """
+    conditions = getattr(con.condition, 'conditions', (con.condition, ))
+    rule = [c for c in conditions if c.__name__ == name]
+    if not rule:
+        return con, None
+    rest = [c for c in conditions if c.__name__ != name]
+    rest_con = None
+    if rest:
+        condition = rest[0] if len(rest) == 1 else Conjunction(rest)
+        rest_con = Constraint(con.scope, condition, con.cache)
+    return rest_con, Constraint(con.scope, rule[0], con.cache)
+
+
+def fuse(constraints: list) -> list:
+    """Merges the constraints with the same scope into one Conjunction
+
+    GAC then searches the supports of a value once for all the rules over
+    a scope, instead of enumerating the same product of domains per rule.
+    The fused constraint takes the place of the first one of its scope.
+    Only plain Constraints are fused (not compiled tables).
+
+    Args:
+        constraints: A list of constraints
+
+    Returns:
+        A new list of constraints
+    """
+    by_scope = {}
+    for con in constraints:
+        if type(con) is Constraint:
+            by_scope.setdefault(con.scope, []).append(con)
+
+    fused = []
+    for con in constraints:
+        group = by_scope.get(con.scope) if type(con) is Constraint else None
+        if group is None or len(group) == 1:
+            fused.append(con)
+        elif group[0] is con:
+            fused.append(
+                Constraint(con.scope,
+                           Conjunction(c.condition for c in group),
+                           con.cache))
+    return fused
@@ -1,42 +1,15 @@
-from music21.note import Note
-from music21.stream import Score, Measure, Part
-from music21.chord import Chord
-from music21.voiceLeading import VoiceLeadingQuartet
-from music21.roman import romanNumeralFromChord, RomanNumeral
-from music21.clef import BassClef, TrebleClef
-from music21.key import Key
 from constraints import *
+from pitches import as_note_value, parse_note_value as Note, transpose
+from theory import Key
+from voicings import notes_from_roman, bass_notes_from_roman, default_tables
 
-Note.__hash__ = lambda self: hash(self.nameWithOctave)
-# ^ Add hash function to Note
-
-
-def notes_from_roman(bottom, top, rn):
-    """Generate all possible not for a range that are in a roman numeral"""
-    possible_notes = []
-    for pitch in rn.pitches:
-        possible_notes.append(pitch.name)
-
-    all_notes = []
-    octave = bottom.octave
-    while octave <= top.octave:
-        for n in possible_notes:
-            actual_note = Note(f'{n}{octave}')
-            if bottom <= actual_note and actual_note <= top:
-                all_notes.append(actual_note)
-        octave += 1
-
-    return all_notes
-
-
-def bass_notes_from_roman(bass_note_list, rn):
-    """Returns a list of the possible bass notes given a rn.
-
-    Use to restrict the domain of the bottom voice to only the bass of
-    the chord for the roman numeral
-    """
-    b = rn.bass().name
-    return list(filter(lambda n: n.name == b, bass_note_list))
+# The default ranges of each part
+DEFAULT_RANGES = {
+    's': (Note('G4'), Note('G5')),
+    'a': (Note('C4'), Note('D5')),
+    't': (Note('E3'), Note('G4')),
+    'b': (Note('C2'), Note('C4'))
+}
 
 
 class NaryCSP:
@@ -59,10 +32,68 @@ class NaryCSP:
         self.variables = set(domains)
         self.domains = domains
         self.constraints = constraints
-        self.var_to_const = {var: set() for var in self.variables}
-        for con in constraints:
+        self.index_constraints()
+
+    def index_constraints(self):
+        """Build the map from each variable to its set of constraints"""
+        self.variables_to_constraints = {var: set() for var in self.variables}
+        for con in self.constraints:
             for var in con.scope:
-                self.var_to_const[var].add(con)
+                self.variables_to_constraints[var].add(con)
+
+    def use_cache(self, cache=None):
+        """Cache the evaluations of every constraint of the CSP
+
+        Args:
+            cache: The EvaluationCache to share between the constraints, or
+                None for a new one with the default memory cap
+
+        Returns:
+            The cache, to read its hit and miss counters
+        """
+        if cache is None:
+            cache = EvaluationCache()
+        for con in self.constraints:
+            con.cache = cache
+        return cache
+
+    def fuse(self):
+        """Fuse the constraints with the same scope (see constraints.fuse)"""
+        self.constraints = fuse(self.constraints)
+        self.index_constraints()
+
+    def remove_rule(self, name: str):
+        """Removes a rule, by the name of its condition, from every constraint
+
+        Fused constraints keep their other conditions (see
+        constraints.split_rule), so rules can be removed by name whether or
+        not the constraints were fused.
+
+        Args:
+            name: The name of the condition, like 'is_pac'
+        """
+        self.constraints = [
+            rest for rest, _ in (split_rule(con, name)
+                                 for con in self.constraints)
+            if rest is not None
+        ]
+        self.index_constraints()
+
+    def compile_tables(self, max_rows=None):
+        """Compile the constraints into table constraints
+
+        Every constraint whose domains have a Cartesian product of at most
+        max_rows tuples is replaced by the table of tuples it allows over the
+        current domains, so that the solver can revise it with STR.
+
+        Args:
+            max_rows: The largest product to compile (tables.MAX_TABLE_ROWS
+                if not given)
+        """
+        from tables import compile_tables, MAX_TABLE_ROWS
+        self.constraints = compile_tables(self.constraints, self.domains,
+                                          max_rows or MAX_TABLE_ROWS)
+        self.index_constraints()
 
 
 class SimpleHarmonizerCSP(NaryCSP):
@@ -74,16 +105,28 @@ class SimpleHarmonizerCSP(NaryCSP):
     Attributes:
         name: The name of the CSP
         notes: The number of notes in the CSP
-        key: The key in which the piece will be (must be a KeySignature object)
+        key: The key in which the piece will be (a theory.Key or music21 Key)
         ranges: A dictionary mapping a part to a tuple of the range of the part. Different
             from tessituras since tessituras enumerates every note in the range
         variables: A string list of all variables in the CSP (one per note)
-        domains: A dictionary that maps variables to their domains
+        domains: A dictionary that maps variables to their domains (lists
+            of NoteValues that appear in a valid voicing of the beat)
+        voicings: A list with the valid voicings of each beat (see
+            voicings.VoicingTables)
         constraints: A list of constraints
         variables_to_constraints: A dictionary that maps variables to the 
             set of contstraints that they're involved in
         parts: A dictionary of that maps parts ('s', 'a', 't', or 'b') to
             a list of the variables in that part
+        decompose_constraints: Whether the voice leading constraints were
+            decomposed into quartets
+        fuse_constraints: Whether the constraints with the same scope were
+            fused into one
+        voicing_tables: The VoicingTables the voicings were looked up in
+        table_ranges: The ranges of the voicing tables the voicings were
+            filtered from (ranges, unless wider ones were given)
+        pac_constraint: The constraint that checks the PAC on the last two
+            beats (fused with others or not), or None if it was removed
     """
     def __init__(self,
                  name: str,
@@ -91,7 +134,11 @@ class SimpleHarmonizerCSP(NaryCSP):
                  numerals: list,
                  part_list=['s', 'a', 't', 'b'],
                  ranges=None,
-                 key=Key('C')):
+                 key=Key('C'),
+                 decompose_constraints=True,
+                 fuse_constraints=True,
+                 voicing_tables=None,
+                 table_ranges=None):
         """Initialize the data structures for the problem
         
         Args:
@@ -101,30 +148,38 @@ class SimpleHarmonizerCSP(NaryCSP):
                 length must be equal to the number of notes.
             part_list: A list of the parts for the CSP. Can contain
                 's' (soprano), 'a' (alto), 't' (tenor), or 'b' (bass)
-            ranges: A dictionary mapping parts to a tuple of their range.
-                It is used for the domains of each variables. If not specified,
+            ranges: A dictionary mapping parts to a tuple of their range
+                (as Notes or NoteValues). It is used for the domains of each variables. If not specified,
                 then the default satb_tessituras are used.
             key: The key we would like the piece to be in. It is C Major 
                 by default.
+            decompose_constraints: Whether to rewrite the two-beat voice
+                leading constraints into 4-ary quartet constraints before
+                solving (see constraints.decompose)
+            fuse_constraints: Whether to merge the constraints with the same
+                scope into one before solving (see constraints.fuse)
+            voicing_tables: The VoicingTables to look the voicings of each
+                beat up in. The tables shared by all CSPs are used by default.
+            table_ranges: Ranges containing ranges to look the voicing
+                tables up for. The voicings within ranges are kept, so CSPs
+                with different ranges share the tables of the wider ones.
+                ranges by default.
         """
         self.name = name
         self.notes = notes
         if len(numerals) != notes:
             raise Exception(
                 'Number of numerals must equal the number of notes')
-        self.numerals = numerals
+        self.numerals = list(numerals)
         self.key = key
+        self.decompose_constraints = decompose_constraints
+        self.fuse_constraints = fuse_constraints
 
         # Set the ranges and for the domains later on
         self.ranges = {}
         if not ranges:
             # These are the default ranges for SATB
-            self.ranges = {
-                's': (Note('G4'), Note('G5')),
-                'a': (Note('C4'), Note('D5')),
-                't': (Note('E3'), Note('G4')),
-                'b': (Note('C2'), Note('C4'))
-            }
+            self.ranges = dict(DEFAULT_RANGES)
         else:
             self.ranges = ranges
 
@@ -139,17 +194,25 @@ class SimpleHarmonizerCSP(NaryCSP):
                 self.variables.append(var_name)
                 self.parts[p].append(var_name)
 
-        # Set the domains to the notes in the roman numerals for
-        # the range of the parts
+        # Look up the valid voicings of the chord on each beat
+        if voicing_tables is None:
+            voicing_tables = default_tables
+        self.voicing_tables = voicing_tables
+        self.table_ranges = table_ranges or self.ranges
+        within = None if self.table_ranges is self.ranges else self.ranges
+        self.voicings = [
+            voicing_tables.get(numerals[i], self.key, self.table_ranges,
+                               part_list, within)
+            for i in range(notes)
+        ]
+
+        # Set the domains to the notes of each part that appear in a valid
+        # voicing of the chord on the beat
         self.domains = {}
-        for v in self.variables:
-            part = v[0]
-            note = int(v[1:])
-            rn = RomanNumeral(numerals[note - 1], self.key)
-            self.domains[v] = notes_from_roman(*self.ranges[part], rn)
-            # If it's the bottom part, restrict the domain to only those notes in the bass
-            if part == part_list[-1]:
-                self.domains[v] = bass_notes_from_roman(self.domains[v], rn)
+        for i, voicings in enumerate(self.voicings):
+            for j, p in enumerate(part_list):
+                self.domains[self.parts[p][i]] = sorted(
+                    {voicing[j] for voicing in voicings})
 
         # Create the no parallel fifths or octaves constraints
         self.constraints = []
@@ -185,7 +248,7 @@ class SimpleHarmonizerCSP(NaryCSP):
             scope = []
             for p in part_list:
                 scope.append(self.parts[p][i])
-            rn = RomanNumeral(numerals[i], self.key)
+            rn = voicing_tables.roman(numerals[i], self.key)
             con = Constraint(tuple(scope), require_root_and_third(rn))
             self.constraints.append(con)
 
@@ -198,12 +261,141 @@ class SimpleHarmonizerCSP(NaryCSP):
         con1 = Constraint(tuple(scope), assert_is_pac(key=self.key))
         self.constraints.append(con1)
 
+        if decompose_constraints:
+            self.constraints = decompose(self.constraints)
+        if fuse_constraints:
+            self.constraints = fuse(self.constraints)
+
         # Create a map from a variable to a set of constraints associated
         # with that variable
-        self.variables_to_constraints = {var: set() for var in self.variables}
-        for con in self.constraints:
+        self.index_constraints()
+
+    def index_constraints(self):
+        """Build the map from each variable to its set of constraints, and
+        find the PAC constraint again"""
+        super().index_constraints()
+        self.pac_constraint = next(
+            (con for con in self.constraints if 'is_pac' in rule_names(con)),
+            None)
+
+    def transposed(self, key, table_ranges=None):
+        """Returns the same harmonization problem in another key
+
+        The new CSP has the numerals, parts and rules of this one
+        (constraints removed from this CSP are left out of it too). Its
+        ranges are transposed from this key to the new one (see
+        transposition.key_interval), so its solutions transposed back are
+        within the ranges of this CSP.
+
+        Args:
+            key: The Key of the new CSP
+            table_ranges: The ranges of the voicing tables of the new CSP
+                (see __init__), or None for its own ranges
+        """
+        from transposition import key_interval
+        steps, semitones = key_interval(key)
+        old_steps, old_semitones = key_interval(self.key)
+        ranges = {
+            p: tuple(
+                transpose(as_note_value(note), steps - old_steps,
+                          semitones - old_semitones) for note in bounds)
+            for p, bounds in self.ranges.items()
+        }
+        csp = SimpleHarmonizerCSP(self.name,
+                                  self.notes,
+                                  self.numerals,
+                                  part_list=list(self.parts),
+                                  ranges=ranges,
+                                  key=key,
+                                  decompose_constraints=self.decompose_constraints,
+                                  fuse_constraints=False,
+                                  voicing_tables=self.voicing_tables,
+                                  table_ranges=table_ranges)
+        rules = {name for con in self.constraints for name in rule_names(con)}
+        csp.constraints = [
+            con for con in csp.constraints if con.condition.__name__ in rules
+        ]
+        csp.fuse_constraints = self.fuse_constraints
+        if self.fuse_constraints:
+            csp.fuse()
+        else:
+            csp.index_constraints()
+        return csp
+
+    def append_beat(self, numeral: str) -> list:
+        """Adds a beat to the end of the progression
+
+        The variables, domains and voicings of the new beat are added, with
+        the constraints within it and between it and the previous beat
+        (decomposed and fused like the others), and the PAC constraint is
+        moved from the old last two beats to the new ones. Nothing else is
+        rebuilt, so the cost does not grow with the length of the CSP.
+
+        Args:
+            numeral: The roman numeral of the new beat (as a string)
+
+        Returns:
+            The list of the constraints added
+        """
+        i = self.notes
+        part_list = list(self.parts)
+        self.notes += 1
+        self.numerals.append(numeral)
+        for p in part_list:
+            self.variables.append(f'{p}{i + 1}')
+            self.parts[p].append(f'{p}{i + 1}')
+            self.variables_to_constraints[f'{p}{i + 1}'] = set()
+
+        within = None if self.table_ranges is self.ranges else self.ranges
+        voicings = self.voicing_tables.get(numeral, self.key,
+                                           self.table_ranges, part_list,
+                                           within)
+        self.voicings.append(voicings)
+        for j, p in enumerate(part_list):
+            self.domains[self.parts[p][i]] = sorted(
+                {voicing[j] for voicing in voicings})
+
+        # The old last two beats are no longer the cadence. Once a beat has
+        # been appended, the PAC constraint is among the last few
+        # constraints, so look for its position from the end of the list
+        pac = self.pac_constraint
+        if pac is not None:
+            j = len(self.constraints) - 1
+            while self.constraints[j] is not pac:
+                j -= 1
+            rest, _ = split_rule(pac, 'is_pac')
+            for var in pac.scope:
+                self.variables_to_constraints[var].discard(pac)
+            if rest is None:
+                del self.constraints[j]
+            else:
+                self.constraints[j] = rest
+                for var in rest.scope:
+                    self.variables_to_constraints[var].add(rest)
+
+        beat1 = tuple(self.parts[p][i - 1] for p in part_list)
+        beat2 = tuple(self.parts[p][i] for p in part_list)
+        rn = self.voicing_tables.roman(numeral, self.key)
+        added = [
+            Constraint(beat1 + beat2, no_parallel_fifths),
+            Constraint(beat1 + beat2, no_parallel_octaves),
+            *(Constraint((n1, n2), different_notes)
+              for n1, n2 in zip(beat1, beat2)),
+            Constraint(beat2, all_notes_different_one_beat),
+            Constraint(beat2, require_root_and_third(rn)),
+            Constraint(beat1 + beat2, assert_is_pac(key=self.key)),
+        ]
+        if self.decompose_constraints:
+            added = decompose(added)
+        if self.fuse_constraints:
+            added = fuse(added)
+        self.constraints.extend(added)
+        for con in added:
             for var in con.scope:
                 self.variables_to_constraints[var].add(con)
+            if 'is_pac' in rule_names(con):
+                self.pac_constraint = con
+        return added
 
     def __str__(self) -> str:
         """String representation of the CSP"""
@@ -219,7 +411,8 @@ class SimpleHarmonizerCSP(NaryCSP):
         print('Constraints:')
         for v in self.variables:
             names = [
-                c.condition.__name__ for c in self.variables_to_constraints[v]
+                name for c in self.variables_to_constraints[v]
+                for name in rule_names(c)
             ]
             print(f'{v}: {", ".join(names)}')
         print()
@@ -1,10 +1,10 @@
-import copy
-from music21.note import Note
+from pitches import as_note_value, to_note
+from theory import roman_figure
 from music21.stream import Part, Measure, Score
 from music21.instrument import Soprano, Alto, Tenor, Bass
 from music21.clef import TrebleClef, BassClef
 from music21.tempo import MetronomeMark
-from music21.roman import romanNumeralFromChord
+from music21.key import Key
 
 satb_voicing = {'s': Soprano(), 'a': Alto(), 't': Tenor(), 'b': Bass()}
 
@@ -12,7 +12,7 @@ def show_sovler_solution(solution, csp, bpm=60, instruments=satb_voicing, method
     """Displays the solution using music21
     
     Args:
-        solution: A dictionary mapping variables to notes
+        solution: A dictionary mapping variables to NoteValues (or Notes)
         csp: The CSP used to solve the problem.
         method: A string of either 'text', 'midi', or 'music' to dictate
             whether to display test or music for the solution
@@ -32,20 +32,20 @@ def show_sovler_solution(solution, csp, bpm=60, instruments=satb_voicing, method
             m.append(tempo)
 
         for i in range(1, 1 + len(csp.parts[p])):
-            n = copy.deepcopy(solution[f'{p}{i}'])
+            n = to_note(solution[f'{p}{i}'])
             m.append(n)
 
         new_part = Part(id=p)
-        new_part.append([instruments[p], clefs[p], csp.key, m])
+        new_part.append([
+            instruments[p], clefs[p],
+            Key(csp.key.tonic.name, csp.key.mode), m
+        ])
         s.append(new_part)
 
     # Add roman numerals
-    sChords = s.chordify().recurse().getElementsByClass('Chord')
-    for c in sChords:
-        rn = romanNumeralFromChord(c, csp.key)
-        c.addLyric(str(rn.figure))
     for (i, n) in enumerate(s.parts[-1].recurse().getElementsByClass('Note')):
-        n.addLyric(str(list(sChords)[i].lyric))
+        notes = [as_note_value(solution[f'{p}{i + 1}']) for p in csp.parts]
+        n.addLyric(roman_figure(notes, csp.key) or '')
 
 
     if method == 'text' or method == 'midi':
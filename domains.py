@@ -0,0 +1,123 @@
+"""Bitset domains with a trail for backtracking
+
+Each variable's domain is an integer whose bits index into a fixed table of
+the variable's values. Changes are recorded on a trail, so a search can
+undo them back to a mark instead of copying every domain at every branch.
+
+Each domain also carries a reason: a bitmask of the search decisions its
+reductions depend on (bit l for the decision at level l), which is trailed
+with it. The solver uses reasons to explain failures (see
+solver.SplitSearch).
+"""
+from collections.abc import MutableMapping
+
+
+class BitsetDomains(MutableMapping):
+    """A {variable : domain} mapping stored as bitsets
+
+    Reading a domain returns a frozenset of values (decoded once per change).
+    Assigning a domain, which must be a subset of the variable's original
+    values, pushes the old bitset on the trail.
+
+    Attributes:
+        values: A {variable : tuple of values} dictionary, the value tables
+        bits: A {variable : int} dictionary of the current bitsets
+        reasons: A {variable : int} dictionary of the decision levels each
+            domain's reductions depend on, as bitmasks
+        trail: A list of (variable, old bitset, old reason) tuples
+    """
+    def __init__(self, domains):
+        """Initialize the bitsets to the full domains
+
+        Args:
+            domains: A {variable : domain} dictionary
+        """
+        self.values = {var: tuple(dom) for var, dom in domains.items()}
+        self._index = {
+            var: {val: i
+                  for i, val in enumerate(vals)}
+            for var, vals in self.values.items()
+        }
+        self.bits = {var: (1 << len(vals)) - 1
+                     for var, vals in self.values.items()}
+        self.reasons = dict.fromkeys(self.values, 0)
+        self.trail = []
+        self._decoded = {}
+
+    def __getitem__(self, var):
+        domain = self._decoded.get(var)
+        if domain is None:
+            bits = self.bits[var]
+            domain = self._decoded[var] = frozenset(
+                val for i, val in enumerate(self.values[var])
+                if bits >> i & 1)
+        return domain
+
+    def __setitem__(self, var, domain):
+        self.set_bits(var, self.encode(var, domain))
+
+    def __delitem__(self, var):
+        raise TypeError('Variables cannot be removed from BitsetDomains')
+
+    def __iter__(self):
+        return iter(self.bits)
+
+    def __len__(self):
+        return len(self.bits)
+
+    def encode(self, var, domain) -> int:
+        """Returns the bitset of a set of values of var"""
+        index = self._index[var]
+        bits = 0
+        for val in domain:
+            bits |= 1 << index[val]
+        return bits
+
+    def set_bits(self, var, bits: int, reason=0):
+        """Sets the bitset of var, recording the old one on the trail
+
+        Args:
+            var: The variable
+            bits: The new bitset
+            reason: A bitmask of decision levels to add to var's reason
+        """
+        old = self.bits[var]
+        old_reason = self.reasons[var]
+        new_reason = old_reason | reason
+        if bits != old or new_reason != old_reason:
+            self.trail.append((var, old, old_reason))
+            self.bits[var] = bits
+            self.reasons[var] = new_reason
+            self._decoded.pop(var, None)
+
+    def restrict(self, var, domain, reason: int):
+        """Sets the domain of var, adding reason to var's reason"""
+        self.set_bits(var, self.encode(var, domain), reason)
+
+    def reason(self, variables) -> int:
+        """Returns the union of the reasons of variables"""
+        reason = 0
+        for var in variables:
+            reason |= self.reasons[var]
+        return reason
+
+    def size(self, var) -> int:
+        """Returns the number of values in the domain of var"""
+        return bin(self.bits[var]).count('1')
+
+    def mark(self) -> int:
+        """Returns a mark of the current state to undo back to"""
+        return len(self.trail)
+
+    def undo(self, mark: int):
+        """Restores the domains to the state they were in at mark"""
+        trail = self.trail
+        while len(trail) > mark:
+            var, bits, reason = trail.pop()
+            self.bits[var] = bits
+            self.reasons[var] = reason
+            self._decoded.pop(var, None)
+
+    def copy(self) -> dict:
+        """Returns a plain {variable : frozenset} snapshot of the domains"""
+        return {var: self[var] for var in self.bits}
@@ -0,0 +1,70 @@
+"""A bounded store of nogoods learned by the splitting search
+
+A nogood is a set of split decisions, each a (variable, bitset) pair saying
+that the variable's domain was restricted to the values of the bitset,
+that together cannot lead to a solution. Any later search state whose
+domains are all within the bitsets of a nogood can then be pruned without
+propagating it. Nogoods are only meaningful for the BitsetDomains they were
+learned on.
+"""
+from collections import OrderedDict
+
+
+class NogoodStore:
+    """The most recently useful nogoods, up to a maximum number
+
+    Attributes:
+        max_size: The number of nogoods kept; the least recently added or
+            used ones are dropped first
+        added: The number of nogoods recorded
+        hits: The number of states pruned by a nogood
+        evictions: The number of nogoods dropped to stay under max_size
+    """
+    def __init__(self, max_size=1000):
+        self.max_size = max_size
+        self.added = 0
+        self.hits = 0
+        self.evictions = 0
+        self._nogoods = OrderedDict()
+
+    def __len__(self):
+        return len(self._nogoods)
+
+    def add(self, decisions):
+        """Records a nogood
+
+        Args:
+            decisions: An iterable of (variable, bitset) pairs. Several
+                decisions on one variable are merged into one.
+        """
+        merged = {}
+        for var, bits in decisions:
+            merged[var] = merged.get(var, bits) & bits
+        if not merged:
+            return
+        nogood = tuple(sorted(merged.items()))
+        if nogood in self._nogoods:
+            self._nogoods.move_to_end(nogood)
+            return
+        self._nogoods[nogood] = None
+        self.added += 1
+        if len(self._nogoods) > self.max_size:
+            self._nogoods.popitem(last=False)
+            self.evictions += 1
+
+    def find(self, domains):
+        """Returns a nogood the domains are within, or None
+
+        Args:
+            domains: The BitsetDomains of the current search state
+        """
+        bits = domains.bits
+        for nogood in self._nogoods:
+            if all(bits[var] & ~allowed == 0 for var, allowed in nogood):
+                self.hits += 1
+                self._nogoods.move_to_end(nogood)
+                return nogood
+        return None
+
+    def clear(self):
+        self._nogoods.clear()
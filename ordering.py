@@ -0,0 +1,158 @@
+"""Variable and value ordering heuristics for domain splitting
+
+A variable ordering is a function (solver, domains) -> variable that picks
+the variable to split among those with more than one value. A value
+ordering is a function (solver, var, domains) -> list that orders the values
+of the variable; the first half of the list is searched first.
+"""
+from domains import BitsetDomains
+from utils import extend
+
+
+def domain_size(domains, var) -> int:
+    if isinstance(domains, BitsetDomains):
+        return domains.size(var)
+    return len(domains[var])
+
+
+def unfixed(solver, domains) -> list:
+    """Returns the variables with more than one value, in CSP order"""
+    return [
+        var for var in solver.csp.variables if domain_size(domains, var) > 1
+    ]
+
+
+def beat_ranks(csp) -> dict:
+    """Returns a {variable : (beat, part)} dictionary for a CSP with parts
+
+    Variables of a CSP without parts are ranked in the CSP order.
+    """
+    parts = getattr(csp, 'parts', None)
+    if parts is None:
+        return {var: (i, 0) for i, var in enumerate(csp.variables)}
+    return {
+        var: (i, j)
+        for j, variables in enumerate(parts.values())
+        for i, var in enumerate(variables)
+    }
+
+
+def beat_neighbours(csp) -> dict:
+    """Returns a {variable : (previous, next)} dictionary of the variables of
+    the same part on the previous and next beats (where there are some)"""
+    neighbours = {}
+    for variables in getattr(csp, 'parts', {}).values():
+        for i, var in enumerate(variables):
+            neighbours[var] = tuple(variables[j] for j in (i - 1, i + 1)
+                                    if 0 <= j < len(variables))
+    return neighbours
+
+
+def input_order(solver, domains):
+    """The first variable with more than one value, in CSP order"""
+    return next(iter(unfixed(solver, domains)), None)
+
+
+def mrv(solver, domains):
+    """The variable with the fewest values (minimum remaining values)"""
+    return min(unfixed(solver, domains),
+               key=lambda var: domain_size(domains, var),
+               default=None)
+
+
+def dom_wdeg(solver, domains):
+    """The variable with the smallest ratio of domain size to weighted degree
+
+    The weighted degree of a variable is the sum of the weights of its
+    constraints that have another variable with more than one value. A
+    constraint's weight is one more than the number of domains it has wiped
+    out (see ACSolver.weights).
+    """
+    best, best_score = None, None
+    for var in unfixed(solver, domains):
+        wdeg = sum(
+            solver.weights.get(con, 1)
+            for con in solver.csp.variables_to_constraints[var]
+            if any(other != var and domain_size(domains, other) > 1
+                   for other in con.scope))
+        score = domain_size(domains, var) / (wdeg or 0.5)
+        if best_score is None or score < best_score:
+            best, best_score = var, score
+    return best
+
+
+def beat_order(solver, domains):
+    """The first variable with more than one value, beat by beat
+
+    Within a beat the parts are taken from the top voice down, so the
+    search fills in one chord at a time from the start of the progression.
+    """
+    ranks = solver.beat_ranks
+    return min(unfixed(solver, domains), key=ranks.__getitem__, default=None)
+
+
+VARIABLE_ORDERINGS = {
+    'input': input_order,
+    'mrv': mrv,
+    'dom/wdeg': dom_wdeg,
+    'beat': beat_order,
+}
+
+
+def pitch_order(solver, var, domains) -> list:
+    """The values from the lowest to the highest"""
+    return sorted(domains[var])
+
+
+def least_constraining(solver, var, domains) -> list:
+    """The values that leave the most values to the other variables first
+
+    Each value is propagated with GAC on its own (with the arc heuristic of
+    the search), and scored by the total size of the domains it leaves.
+    Values that propagate to a wipeout come last. The wipeouts of these
+    probes are not conflicts of the search, so the constraint weights and
+    the last conflict of the solver are restored afterwards.
+    """
+    to_do = solver.new_to_do(var, None)
+    weights = dict(solver.weights)
+    last_conflict = solver.last_conflict
+    scores = {}
+    for val in domains[var]:
+        if isinstance(domains, BitsetDomains):
+            mark = domains.mark()
+            domains[var] = {val}
+            consistent, reduced, checks = solver.GAC(domains, to_do,
+                                                     solver.arc_heuristic)
+            score = sum(domains.size(v) for v in domains) if consistent else -1
+            domains.undo(mark)
+        else:
+            consistent, reduced, checks = solver.GAC(
+                extend(domains, var, {val}), to_do, solver.arc_heuristic)
+            score = sum(len(d) for d in reduced.values()) if consistent else -1
+        solver.stats['checks'] += checks
+        scores[val] = score
+    solver.weights.clear()
+    solver.weights.update(weights)
+    solver.last_conflict = last_conflict
+    return sorted(scores, key=lambda val: (-scores[val], val))
+
+
+def closest_to_previous(solver, var, domains) -> list:
+    """The values closest to the note of the same part on the previous beat
+
+    If that note is not fixed yet, the note on the next beat is used, and
+    if neither is, the values are in pitch order.
+    """
+    for other in solver.beat_neighbours.get(var, ()):
+        if domain_size(domains, other) == 1:
+            reference = next(iter(domains[other])).midi
+            return sorted(domains[var],
+                          key=lambda val: (abs(val.midi - reference), val))
+    return sorted(domains[var])
+
+
+VALUE_ORDERINGS = {
+    'pitch': pitch_order,
+    'lcv': least_constraining,
+    'closest': closest_to_previous,
+}
@@ -0,0 +1,110 @@
+"""Persistent {variable : domain} maps with structural sharing
+
+A PersistentDomains is never changed in place. Setting a domain returns a
+new map that shares everything but one leaf of BRANCHING domains (and the
+tuple of leaves) with the old one, so the states of a search tree cost a
+few small tuples each instead of a full copy of the domains. Its copy
+method returns a DomainsEvolver, a mutable map that copies a leaf only the
+first time one of its domains is set, so functions written for plain
+dictionaries (like ACSolver.GAC) work on it unchanged.
+"""
+from collections.abc import Mapping, MutableMapping
+
+BRANCHING = 16
+
+
+class PersistentDomains(Mapping):
+    """An immutable {variable : domain} mapping
+
+    All the versions of a map share the index of its variables, so they
+    always have the same variables.
+    """
+    __slots__ = ('_index', '_leaves')
+
+    def __init__(self, domains):
+        """Initialize the map
+
+        Args:
+            domains: A {variable : domain} dictionary
+        """
+        self._index = {var: i for i, var in enumerate(domains)}
+        values = list(domains.values())
+        self._leaves = tuple(
+            tuple(values[i:i + BRANCHING])
+            for i in range(0, len(values), BRANCHING))
+
+    @classmethod
+    def _from_leaves(cls, index, leaves):
+        domains = cls.__new__(cls)
+        domains._index = index
+        domains._leaves = leaves
+        return domains
+
+    def __getitem__(self, var):
+        i = self._index[var]
+        return self._leaves[i // BRANCHING][i % BRANCHING]
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def __repr__(self):
+        return f'PersistentDomains({dict(self)})'
+
+    def set(self, var, domain):
+        """Returns a new map with the domain of var set to domain"""
+        leaf, i = divmod(self._index[var], BRANCHING)
+        values = list(self._leaves[leaf])
+        values[i] = domain
+        leaves = list(self._leaves)
+        leaves[leaf] = tuple(values)
+        return PersistentDomains._from_leaves(self._index, tuple(leaves))
+
+    def copy(self):
+        """Returns a DomainsEvolver starting from this map"""
+        return DomainsEvolver(self)
+
+
+class DomainsEvolver(MutableMapping):
+    """A mutable {variable : domain} mapping built on a PersistentDomains
+
+    Leaves are copied the first time one of their domains is set, and
+    persistent returns the result as a new PersistentDomains.
+    """
+    def __init__(self, domains: PersistentDomains):
+        self._index = domains._index
+        self._leaves = list(domains._leaves)
+        self._copied = set()
+
+    def __getitem__(self, var):
+        i = self._index[var]
+        return self._leaves[i // BRANCHING][i % BRANCHING]
+
+    def __setitem__(self, var, domain):
+        leaf, i = divmod(self._index[var], BRANCHING)
+        if leaf not in self._copied:
+            self._leaves[leaf] = list(self._leaves[leaf])
+            self._copied.add(leaf)
+        self._leaves[leaf][i] = domain
+
+    def __delitem__(self, var):
+        raise TypeError('Variables cannot be removed from domains')
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self):
+        return len(self._index)
+
+    def copy(self):
+        return DomainsEvolver(self.persistent())
+
+    def persistent(self) -> PersistentDomains:
+        """Returns the current domains as a PersistentDomains"""
+        for leaf in self._copied:
+            self._leaves[leaf] = tuple(self._leaves[leaf])
+        self._copied.clear()
+        return PersistentDomains._from_leaves(self._index,
+                                              tuple(self._leaves))
@@ -0,0 +1,144 @@
+"""Compact pitch values used as the domain values of the CSPs
+
+The solver only needs the MIDI number and the spelled name of a note, so
+instead of music21 Note objects the domains hold interned NoteValue objects.
+They are converted back to music21 Notes only for rendering.
+"""
+import copy
+
+STEP_PITCH_CLASSES = {'C': 0, 'D': 2, 'E': 4, 'F': 5, 'G': 7, 'A': 9, 'B': 11}
+STEP_INDICES = {'C': 0, 'D': 1, 'E': 2, 'F': 3, 'G': 4, 'A': 5, 'B': 6}
+STEP_NAMES = 'CDEFGAB'
+
+
+def alter_of(name: str) -> int:
+    """Returns the alteration in semitones of a pitch name like 'C#' or 'B-'"""
+    return name.count('#') - name.count('-')
+
+
+def pitch_class_of(name: str) -> int:
+    """Returns the pitch class (0-11) of a spelled pitch name"""
+    return (STEP_PITCH_CLASSES[name[0]] + alter_of(name)) % 12
+
+
+class NoteValue:
+    """A spelled note reduced to what the constraints need
+
+    Values are interned by note_value, so two values for the same spelled
+    note are the same object. Do not construct this class directly.
+
+    Attributes:
+        name: The spelled pitch name without octave (e.g. 'C#', 'B-')
+        octave: The octave of the note
+        midi: The MIDI number of the note
+        pc: The pitch class (0-11) of the note
+        step: The diatonic step number of the note (7 per octave), used
+            to tell intervals apart by their spelling
+    """
+    __slots__ = ('name', 'octave', 'midi', 'pc', 'step', '_hash')
+
+    def __init__(self, name: str, octave: int):
+        self.name = name
+        self.octave = octave
+        self.midi = 12 * (octave + 1) + STEP_PITCH_CLASSES[name[0]] + alter_of(
+            name)
+        self.pc = self.midi % 12
+        self.step = 7 * octave + STEP_INDICES[name[0]]
+        # Deterministic across processes, unlike hashing the name
+        self._hash = self.midi * 16 + alter_of(name) + 8
+
+    @property
+    def nameWithOctave(self) -> str:
+        return f'{self.name}{self.octave}'
+
+    def __repr__(self):
+        return f'<NoteValue {self.nameWithOctave}>'
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        return self is other or (isinstance(other, NoteValue)
+                                 and self.name == other.name
+                                 and self.octave == other.octave)
+
+    def __lt__(self, other):
+        return (self.midi, self.name) < (other.midi, other.name)
+
+    def __reduce__(self):
+        # Keep values interned when they cross process boundaries
+        return (note_value, (self.name, self.octave))
+
+
+_interned = {}
+
+
+def note_value(name: str, octave: int) -> NoteValue:
+    """Returns the interned NoteValue for a pitch name and octave"""
+    key = (name, octave)
+    value = _interned.get(key)
+    if value is None:
+        value = _interned[key] = NoteValue(name, octave)
+    return value
+
+
+def parse_note_value(name_with_octave: str) -> NoteValue:
+    """Returns the NoteValue for a string like 'C#4' or 'B-3'"""
+    i = len(name_with_octave)
+    while name_with_octave[i - 1].isdigit():
+        i -= 1
+    return note_value(name_with_octave[:i], int(name_with_octave[i:]))
+
+
+def transpose(value: NoteValue, steps: int, semitones: int) -> NoteValue:
+    """Transposes a NoteValue by a spelled interval
+
+    Args:
+        value: The NoteValue to transpose
+        steps: The diatonic steps of the interval (e.g. 2 for a third)
+        semitones: The semitones of the interval (e.g. 3 for a minor third)
+
+    Returns:
+        The NoteValue spelled the interval away from value (so C4 up a
+        minor third is E-4, never D#4)
+    """
+    step = value.step + steps
+    octave, index = divmod(step, 7)
+    letter = STEP_NAMES[index]
+    alter = value.midi + semitones - 12 * (octave + 1) - STEP_PITCH_CLASSES[
+        letter]
+    return note_value(letter + ('#' * alter if alter > 0 else '-' * -alter),
+                      octave)
+
+
+def as_note_value(note) -> NoteValue:
+    """Converts a music21 Note (or an existing NoteValue) to a NoteValue"""
+    if isinstance(note, NoteValue):
+        return note
+    return note_value(note.pitch.name, note.pitch.octave)
+
+
+def to_note(value):
+    """Returns a new music21 Note for a NoteValue (or a copy of a Note)"""
+    from music21.note import Note
+    if isinstance(value, Note):
+        return copy.deepcopy(value)
+    return Note(value.nameWithOctave)
+
+
+_shared_notes = {}
+
+
+def shared_note(value):
+    """Returns a cached music21 Note for a NoteValue
+
+    The Note is shared between calls, so it must only be read (e.g. by the
+    music21 based constraints). Use to_note for a Note that can be modified.
+    Music21 Notes are passed through unchanged.
+    """
+    if not isinstance(value, NoteValue):
+        return value
+    note = _shared_notes.get(value)
+    if note is None:
+        note = _shared_notes[value] = to_note(value)
+    return note
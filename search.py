@@ -93,6 +93,12 @@ class Node:
             for action in problem.actions(self.state)
         ]
 
+    def iter_expand(self, problem):
+        """Yield the nodes reachable in one step from this node, last action
+        first, building each one only when it is asked for."""
+        for action in reversed(list(problem.actions(self.state))):
+            yield self.child_node(problem, action)
+
     def child_node(self, problem, action):
         """[Figure 3.10]"""
         next_state = problem.result(self.state, action)
@@ -135,13 +141,21 @@ def depth_first_tree_search(problem):
     Search through the successors of a problem to find a goal.
     The argument frontier should be an empty queue.
     Repeats infinitely in case of loops.
+
+    Successors are generated lazily: the frontier holds an iterator over
+    the children of each node on the current path, and a child is only
+    built (with problem.result) when it is popped. As with a stack of
+    expanded nodes, the last action is searched first.
     """
 
-    frontier = [Node(problem.initial)]  # Stack
+    frontier = [iter([Node(problem.initial)])]  # Stack of child iterators
 
     while frontier:
-        node = frontier.pop()
+        node = next(frontier[-1], None)
+        if node is None:
+            frontier.pop()
+            continue
         if problem.goal_test(node.state):
             return node
-        frontier.extend(node.expand(problem))
+        frontier.append(node.iter_expand(problem))
     return None
\ No newline at end of file
@@ -0,0 +1,193 @@
+"""A persistent cache of the solutions of harmonizer CSPs
+
+Solutions are stored in an SQLite file, keyed by a hash of everything that
+determines them: the numerals, the key, the parts and their ranges, the
+rules the CSP was built with and CONSTRAINT_SET_VERSION. Progressions that
+have no solution are cached too.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+from constraints import CONSTRAINT_SET_VERSION, rule_names
+from pitches import parse_note_value
+from solver import ACSolver
+from voicings import key_name, range_names
+
+
+def problem_key(csp, key=None, ranges=None) -> str:
+    """Returns the hex digest identifying the problem of a SimpleHarmonizerCSP
+
+    Args:
+        csp: A SimpleHarmonizerCSP
+        key: The key to identify the problem by instead of csp.key
+        ranges: The ranges to identify the problem by instead of csp.ranges
+
+    Returns:
+        A SHA-256 hex digest
+    """
+    part_list = list(csp.parts)
+    problem = {
+        'version': CONSTRAINT_SET_VERSION,
+        'numerals': list(csp.numerals),
+        'key': key_name(key or csp.key),
+        'parts': part_list,
+        'ranges': range_names(ranges or csp.ranges, part_list),
+        'rules': sorted({name
+                         for con in csp.constraints
+                         for name in rule_names(con)}),
+    }
+    encoded = json.dumps(problem, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(encoded.encode()).hexdigest()
+
+
+class SolutionCache:
+    """A size-bounded cache of solutions in an SQLite file
+
+    The least recently used solutions are evicted once the stored solutions
+    take up more than max_bytes. Lookups only read the file: the times
+    solutions were used are kept in memory and written with the next put
+    (or on close).
+
+    Attributes:
+        path: The SQLite file (':memory:' for a cache that is not saved)
+        max_bytes: The approximate size the stored solutions may take up
+        hits: The number of lookups answered from the cache
+        misses: The number of lookups that had to solve the CSP
+        evictions: The number of solutions dropped to stay under max_bytes
+    """
+    def __init__(self, path=':memory:', max_bytes=64 * 2**20):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._used = {}
+        self._db = sqlite3.connect(path, timeout=30)
+        # Keep commits cheap and let concurrent readers and a writer share
+        # the file
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('CREATE TABLE IF NOT EXISTS solutions ('
+                         'key TEXT PRIMARY KEY, '
+                         'solution TEXT, '
+                         'size INTEGER NOT NULL, '
+                         'used REAL NOT NULL)')
+        self._db.execute('CREATE INDEX IF NOT EXISTS solutions_used '
+                         'ON solutions (used)')
+        self._db.commit()
+
+    def __len__(self):
+        return self._db.execute('SELECT COUNT(*) FROM solutions').fetchone()[0]
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    @property
+    def nbytes(self) -> int:
+        """The total size of the stored solutions"""
+        return self._db.execute(
+            'SELECT COALESCE(SUM(size), 0) FROM solutions').fetchone()[0]
+
+    def get(self, key: str):
+        """Looks a solution up
+
+        Args:
+            key: The problem_key of the CSP
+
+        Returns:
+            A (found, solution) tuple, where solution is a {variable :
+            NoteValue} dictionary or False if the CSP has no solution
+        """
+        row = self._db.execute('SELECT solution FROM solutions WHERE key = ?',
+                               (key, )).fetchone()
+        if row is None:
+            return False, None
+        self._used[key] = time.time()
+        if row[0] is None:
+            return True, False
+        return True, {
+            var: parse_note_value(name)
+            for var, name in json.loads(row[0]).items()
+        }
+
+    def put(self, key: str, solution):
+        """Stores a solution, evicting old ones if needed
+
+        Args:
+            key: The problem_key of the CSP
+            solution: A {variable : NoteValue} dictionary, or a false value
+                if the CSP has no solution
+        """
+        encoded = None
+        if solution:
+            encoded = json.dumps(
+                {var: value.nameWithOctave
+                 for var, value in solution.items()})
+        size = len(key) + len(encoded or '')
+        with self._db:
+            self._write_used()
+            self._db.execute(
+                'INSERT OR REPLACE INTO solutions VALUES (?, ?, ?, ?)',
+                (key, encoded, size, time.time()))
+            self._evict()
+
+    def _write_used(self):
+        self._db.executemany('UPDATE solutions SET used = ? WHERE key = ?',
+                             [(used, key)
+                              for key, used in self._used.items()])
+        self._used.clear()
+
+    def _evict(self):
+        excess = self.nbytes - self.max_bytes
+        if excess <= 0:
+            return
+        rows = self._db.execute(
+            'SELECT key, size FROM solutions ORDER BY used').fetchall()
+        evicted = []
+        for key, size in rows:
+            if excess <= 0:
+                break
+            evicted.append((key, ))
+            excess -= size
+        self._db.executemany('DELETE FROM solutions WHERE key = ?', evicted)
+        self.evictions += len(evicted)
+
+    def solve(self, csp, solve=None):
+        """Returns the solution of a CSP, from the cache if possible
+
+        Args:
+            csp: A SimpleHarmonizerCSP
+            solve: A function from the CSP to its solution (a {variable :
+                NoteValue} dictionary or False), called on a miss.
+                ACSolver's domain splitting by default.
+
+        Returns:
+            The solution, or False if there is none
+        """
+        key = problem_key(csp)
+        found, solution = self.get(key)
+        if found:
+            self.hits += 1
+            return solution
+
+        self.misses += 1
+        if solve is None:
+            solution = ACSolver(csp).domain_splitting()
+        else:
+            solution = solve(csp)
+        self.put(key, solution)
+        return solution
+
+    def clear(self):
+        """Drops all solutions (the counters are kept)"""
+        with self._db:
+            self._db.execute('DELETE FROM solutions')
+
+    def close(self):
+        if self._used:
+            with self._db:
+                self._write_used()
+        self._db.close()
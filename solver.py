@@ -1,10 +1,19 @@
+import itertools
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
 import search
-from sortedcontainers import SortedSet
-from search import depth_first_tree_search
-from utils import extend, first
+from utils import first
 from csp import Constraint, NaryCSP, SimpleHarmonizerCSP
-from display import show_sovler_solution
-from music21.key import Key
+from constraints import split_rule
+from tables import TableConstraint
+from domains import BitsetDomains
+from worklist import ArcWorklist, arity
+from ordering import beat_neighbours, beat_ranks, input_order, pitch_order
+from nogoods import NogoodStore
+from persistent import PersistentDomains
+from transitions import TransitionBuilder
 
 
 def sat_up(to_do: set):
@@ -14,28 +23,24 @@ def sat_up(to_do: set):
         to_do: A set of to-do's, which are (variable, constraint) pairs
 
     Returns:
-        A new SortedSet with the ordered to-do's
+        A new ArcWorklist that pops the to-do's with the smallest scope first
     """
-    def reciprocal_scope_length(t):
-        scope_length = len([var for var in t[1].scope])
-        return 1 / scope_length
+    return ArcWorklist(to_do, priority=arity)
 
-    return SortedSet(to_do, key=reciprocal_scope_length)
 
-
-def partition_domain(dom: list):
+def partition_domain(dom):
     """Partitions domain dom into two
     
     Args:
-        dom: A list of values that is a domain for a variables
+        dom: A set of values that is a domain for a variables, split in
+            sorted order, or a list of them, split in its own order
 
     Returns:
         A tuple of the split domain (first half, second half)
     """
-    split = len(dom) // 2
-    dom1 = set(list(dom)[:split])
-    dom2 = dom - dom1
-    return dom1, dom2
+    values = dom if isinstance(dom, list) else sorted(dom)
+    split = len(values) // 2
+    return set(values[:split]), set(values[split:])
 
 
 class ACSolver:
@@ -44,10 +49,55 @@ class ACSolver:
     
     Attributes:
         csp: The CSP problem to be solved
+        residues: A {(variable, value, constraint) : support} dictionary of
+            the last support found for each value, as the tuple of values of
+            the other variables in the scope. They stay valid as long as
+            those values are in the domains, so they are kept between calls.
+        variable_ordering: The function picking the variable to split (see
+            ordering.py)
+        value_ordering: The function ordering the values of the split
+            variable; the first half is searched first
+        weights: A {constraint : weight} dictionary, one more than the
+            number of domains each constraint has wiped out (for dom_wdeg)
+        last_conflict: The constraint of the last wipeout GAC found
+        nogoods: The NogoodStore of the last search started
+        arc_heuristic: The arc heuristic of the last search started
+        max_nogoods: The number of nogoods a search keeps
+        stats: Counters of the searches done by the solver: the constraint
+            checks of their propagations, the splits, the dead ends, the
+            backjumps and the states pruned by nogoods, the peak memory of
+            the search stack and trail (see SplitSearch) and the names of
+            the orderings
     """
-    def __init__(self, csp: NaryCSP):
+    def __init__(self,
+                 csp: NaryCSP,
+                 variable_ordering=input_order,
+                 value_ordering=pitch_order,
+                 max_nogoods=1000):
         """A CSP solver that uses arc consistency"""
         self.csp = csp
+        self.residues = {}
+        self.variable_ordering = variable_ordering
+        self.value_ordering = value_ordering
+        self.weights = {}
+        self.last_conflict = None
+        self.max_nogoods = max_nogoods
+        self.nogoods = NogoodStore(max_nogoods)
+        self.arc_heuristic = sat_up
+        self.beat_ranks = beat_ranks(csp)
+        self.beat_neighbours = beat_neighbours(csp)
+        self.stats = {
+            'checks': 0,
+            'splits': 0,
+            'dead_ends': 0,
+            'backjumps': 0,
+            'nogood_prunes': 0,
+            'estimated_peak_bytes': 0,
+            'variable_ordering': variable_ordering.__name__,
+            'value_ordering': value_ordering.__name__,
+        }
+        # Set by another process to stop the search (see parallel_domain_splitting)
+        self.stop_event = None
 
     def GAC(self,
             orig_domains=None,
@@ -58,9 +108,12 @@ class ACSolver:
         Makes this CSP arc-consistent using Generalized Arc Consistency
 
         Args:
-            orig_domains: The original domains
+            orig_domains: The original domains. If they are BitsetDomains,
+                they are reduced in place (the changes go on their trail)
+                instead of being copied.
             to_do: A set of (variable, constraint) pairs
-            arc_heuristic: A function that takes a set of to_do's and orders them
+            arc_heuristic: A function that takes a set of to_do's and orders
+                them, returning an ArcWorklist
         
         Returns:
             The reduced domains (an arc-consistent {variable : domain} dictionary)
@@ -75,9 +128,14 @@ class ACSolver:
         else:
             to_do = to_do.copy()
 
-        domains = orig_domains.copy()
+        if isinstance(orig_domains, BitsetDomains):
+            domains = orig_domains
+        else:
+            domains = orig_domains.copy()
         to_do = arc_heuristic(to_do)
         checks = 0
+        # Rows of each table constraint still valid in this propagation
+        table_rows = {}
 
         while to_do:
             debug and print(f'To-do set size: {len(to_do)}')
@@ -85,6 +143,15 @@ class ACSolver:
             var, const = to_do.pop()
             debug and print(f'Variable to examine: {var}')
 
+            if isinstance(const, TableConstraint):
+                consistent, checks = self.revise_table(domains, const,
+                                                       table_rows, to_do,
+                                                       checks)
+                if not consistent:
+                    self.wipeout(const)
+                    return False, domains, checks
+                continue
+
             other_vars = [ov for ov in const.scope if ov != var]
             new_domain = set()
             if len(other_vars) == 0:
@@ -97,10 +164,15 @@ class ACSolver:
             elif len(other_vars) == 1:
                 other = other_vars[0]
                 for val in domains[var]:
+                    residue = self.residues.get((var, val, const))
+                    if residue is not None and residue[0] in domains[other]:
+                        new_domain.add(val)
+                        continue
                     for other_val in domains[other]:
                         checks += 1
                         if const.holds({var: val, other: other_val}):
                             new_domain.add(val)
+                            self.residues[var, val, const] = (other_val, )
                             break
                 # new_domain = {val for val in domains[var]
                 #               if any(const.holds({var: val, other: other_val})
@@ -111,8 +183,15 @@ class ACSolver:
                     if debug:
                         print(f'Seeing if {var} = {val} holds:')
                         print(f'\tdomain for {var} is {domains[var]}')
+                    residue = self.residues.get((var, val, const))
+                    if residue is not None and all(
+                            ov in domains[o]
+                            for o, ov in zip(other_vars, residue)):
+                        new_domain.add(val)
+                        continue
+                    env = {var: val}
                     holds, checks = self.any_holds(domains,
-                                                   const, {var: val},
+                                                   const, env,
                                                    other_vars,
                                                    checks=checks,
                                                    debug=debug)
@@ -120,19 +199,73 @@ class ACSolver:
                     debug and print(f'\n{var} = {val} holds?: {holds}')
                     if holds:
                         new_domain.add(val)
+                        self.residues[var, val, const] = tuple(
+                            env[o] for o in other_vars)
                 # new_domain = {val for val in domains[var]
                 #               if self.any_holds(domains, const, {var: val}, other_vars)}
 
             if new_domain != domains[var]:
-                domains[var] = new_domain
+                self.reduce(domains, var, new_domain, const)
                 if not new_domain:
+                    self.wipeout(const)
                     return False, domains, checks
-                add_to_do = self.new_to_do(var, const).difference(to_do)
-                to_do |= add_to_do
+                to_do.update(self.new_to_do(var, const))
 
             debug and print()
         return True, domains, checks
 
+    def reduce(self, domains, var, domain, const: Constraint):
+        """Sets the domain of var after revising const
+
+        On BitsetDomains the reduction is explained by the reasons of all
+        the variables of const.
+        """
+        if isinstance(domains, BitsetDomains):
+            domains.restrict(var, domain, domains.reason(const.scope))
+        else:
+            domains[var] = domain
+
+    def wipeout(self, const: Constraint):
+        """Records that revising const emptied a domain"""
+        self.last_conflict = const
+        self.weights[const] = self.weights.get(const, 1) + 1
+
+    def revise_table(self, domains, const, table_rows, to_do, checks=0):
+        """Revises every variable of a table constraint with STR
+
+        The rows of the table that are no longer valid are dropped from
+        table_rows[const], and the domain of each variable in the scope is
+        reduced to the values that still appear in a valid row. The other
+        queued arcs of const are dropped from to_do, since this pass
+        revises them too.
+
+        Args:
+            domains: The {variable : domain} dictionary being reduced
+            const: A TableConstraint
+            table_rows: A {constraint : row indices} dictionary
+            to_do: The ArcWorklist, extended with the arcs to recheck
+            checks: Number of checks done so far
+
+        Returns:
+            A tuple of whether all domains are still non-empty and the
+            number of checks
+        """
+        # One pass revises every variable, so the other arcs of the table
+        # need not be revised until a domain in its scope changes again
+        for var in const.scope:
+            to_do.discard((var, const))
+        rows = table_rows.get(const)
+        checks += len(const.table) if rows is None else len(rows)
+        rows = table_rows[const] = const.valid_rows(domains, rows)
+        for var in const.scope:
+            new_domain = const.supported_values(rows, var)
+            if new_domain != domains[var]:
+                self.reduce(domains, var, new_domain, const)
+                if not new_domain:
+                    return False, checks
+                to_do.update(self.new_to_do(var, const))
+        return True, checks
+
     def new_to_do(self, var: str, const: Constraint):
         """
         Args:
@@ -170,10 +303,21 @@ class ACSolver:
             that extends env with the variables in other_vars[ind:]
             env is a dictionary.
             Warning: this has side effects and changes the elements of env
+
+        If the condition of const has a partial check, the other variables
+        are assigned from the smallest domain up, and every partial
+        assignment is checked so that the values it rules out are not
+        extended. Each partial check counts as a check.
         """
         if debug and checks % 1000 == 0:
             print(f'\rChecks: {checks}', end='')
 
+        partial = const.partial is not None
+        if ind == 0 and partial:
+            if not const.partial_holds(env):
+                return False, checks + 1
+            other_vars = sorted(other_vars, key=lambda v: len(domains[v]))
+
         if ind == len(other_vars):
             return const.holds(env), checks + 1
         else:
@@ -181,6 +325,10 @@ class ACSolver:
             for val in domains[var]:
                 # env = dict_union(env, {var:val})  # no side effects
                 env[var] = val
+                if partial and ind + 1 < len(other_vars):
+                    checks += 1
+                    if not const.partial_holds(env):
+                        continue
                 holds, checks = self.any_holds(domains,
                                                const,
                                                env,
@@ -190,11 +338,18 @@ class ACSolver:
                                                debug=debug)
                 if holds:
                     return True, checks
+            env.pop(var, None)
             return False, checks
 
     def domain_splitting(self, domains=None, to_do=None, arc_heuristic=sat_up):
         """Finds a solution to the current CSP
 
+        The domains are held as BitsetDomains for the whole search. Each
+        split and each propagation changes them in place, and the changes
+        are undone from the trail on backtracking, so no branch copies the
+        domains. The search keeps its own stack (see SplitSearch), so its
+        depth is not limited by Python's recursion limit.
+
         Args:
             domains: A list of domains
             to_do: The set of to-do's
@@ -204,82 +359,794 @@ class ACSolver:
             A solution to the current CSP or False if there are no solutions
             to_do is the list of arcs to check.
         """
+        return first(self.iter_solutions(domains, to_do, arc_heuristic, 1),
+                     False)
+
+    def parallel_domain_splitting(self,
+                                  domains=None,
+                                  to_do=None,
+                                  arc_heuristic=sat_up,
+                                  split_depth=4,
+                                  max_workers=None):
+        """Finds a solution to the current CSP, splitting on several processes
+
+        The search is done serially down to split_depth splits. The subtrees
+        below that are searched by a process pool, and as soon as one worker
+        finds a solution the others are stopped. The workers are forked so
+        they share the CSP without pickling it; where fork is not available
+        this is the same as domain_splitting.
+
+        Args:
+            domains: A list of domains
+            to_do: The set of to-do's
+            arc_heuristic: A function that is the arc heuristic
+            split_depth: The number of splits done before farming out the
+                subtrees (up to 2 ** split_depth of them)
+            max_workers: The number of processes (os.cpu_count() by default)
+
+        Returns:
+            A solution to the current CSP or False if there are no solutions
+        """
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return self.domain_splitting(domains, to_do, arc_heuristic)
         if domains is None:
             domains = self.csp.domains
-        consistency, new_domains, _ = self.GAC(domains, to_do, arc_heuristic)
-        if not consistency:
-            return False
-        elif all(len(new_domains[var]) == 1 for var in domains):
-            return {var: first(new_domains[var]) for var in domains}
+        if not isinstance(domains, BitsetDomains):
+            domains = BitsetDomains(domains)
+
+        subtrees = []
+        search = self.split_search(domains, to_do, arc_heuristic, split_depth,
+                                   subtrees)
+        solution = search.run() or False
+        search.close()
+        if solution or not subtrees:
+            return solution
+
+        context = multiprocessing.get_context('fork')
+        stop_event = context.Event()
+        with ProcessPoolExecutor(max_workers,
+                                 mp_context=context,
+                                 initializer=_init_split_worker,
+                                 initargs=(self, stop_event)) as pool:
+            futures = [
+                pool.submit(_split_subtree, subtree, var, arc_heuristic)
+                for subtree, var in subtrees
+            ]
+            for future in as_completed(futures):
+                solution = future.result()
+                if solution:
+                    stop_event.set()
+                    for f in futures:
+                        f.cancel()
+                    break
+        return solution
+
+    def split_search(self,
+                     domains=None,
+                     to_do=None,
+                     arc_heuristic=sat_up,
+                     split_depth=None,
+                     subtrees=None):
+        """Starts a domain splitting search that can be paused and resumed
+
+        Args:
+            domains: A list of domains (kept in place if BitsetDomains)
+            to_do: The set of to-do's
+            arc_heuristic: A function that is the arc heuristic
+            split_depth: With subtrees, the depth at which to stop splitting
+            subtrees: A list to append the unsearched subtrees at split_depth
+                to, as ({variable : domain}, split variable) pairs
+
+        Returns:
+            A SplitSearch; call its run method to search
+        """
+        if domains is None:
+            domains = self.csp.domains
+        if not isinstance(domains, BitsetDomains):
+            domains = BitsetDomains(domains)
+        return SplitSearch(self, domains, to_do, arc_heuristic, split_depth,
+                           subtrees)
+
+    def iter_solutions(self,
+                       domains=None,
+                       to_do=None,
+                       arc_heuristic=sat_up,
+                       limit=None,
+                       time_budget=None):
+        """Yields every solution of the CSP in search order
+
+        The search state (the trailed domains and the residues) is kept
+        between solutions, so getting the next one continues the search
+        where it stopped instead of starting over.
+
+        Args:
+            domains: A list of domains
+            to_do: The set of to-do's
+            arc_heuristic: A function that is the arc heuristic
+            limit: The maximum number of solutions to yield
+            time_budget: The number of seconds after which to stop searching
+
+        Yields:
+            Solutions as {variable : value} dictionaries
+        """
+        if limit is not None and limit <= 0:
+            return
+        deadline = None
+        if time_budget is not None:
+            deadline = time.monotonic() + time_budget
+        search = self.split_search(domains, to_do, arc_heuristic)
+        try:
+            count = 0
+            while limit is None or count < limit:
+                solution = search.run(deadline=deadline)
+                if solution is None:
+                    return
+                count += 1
+                yield solution
+        finally:
+            search.close()
+
+
+# Marks that SplitSearch has no node to propagate
+_NO_NODE = object()
+
+
+class SplitSearch:
+    """An iterative domain splitting search over trailed BitsetDomains
+
+    The search keeps an explicit stack with one frame per split on the
+    current path. A frame holds the trail marks to undo to and the halves
+    of the split domain still to search, as bitsets; all the changes to the
+    domains are on their trail. run searches until the next solution and
+    can be stopped after a number of nodes or at a deadline, then called
+    again to resume where it stopped.
+
+    The split at level l (the number of splits above it) restricts the
+    domain of its variable with reason bit l, and GAC explains each
+    reduction by the reasons of the constraint's variables, so the failure
+    of a subtree is explained by the reasons of the wiped out constraint
+    (or of the nogood it matched). If the failure of the first half of a
+    split does not depend on the split, the second half would fail too, so
+    it is skipped (backjumping). When both halves fail, the decisions the
+    failure depends on are recorded as a nogood.
+
+    Attributes:
+        solver: The ACSolver whose GAC, orderings and stats are used
+        domains: The BitsetDomains being searched, restored to their state
+            on entry when the search is done or closed
+        nogoods: The NogoodStore of the search (also set as solver.nogoods)
+        stack: The frames of the splits on the current path
+        decisions: The (variable, bitset) decisions on the current path
+        done: Whether the whole search space has been searched
+        nodes: The number of nodes propagated
+        peak_depth: The largest number of frames on the stack
+        peak_trail: The largest number of entries on the trail
+        estimated_peak_bytes: An estimate of the largest memory held by the
+            stack and the trail, counting TRAIL_ENTRY_BYTES per trail entry
+            and FRAME_BYTES per frame. It is not measured.
+    """
+    # Typical sys.getsizeof totals of a trail entry (the tuple and the old
+    # bitset and reason) and of a frame (the dict, its to-do set and the
+    # halves), on an 8-beat progression
+    TRAIL_ENTRY_BYTES = 120
+    FRAME_BYTES = 2700
+
+    def __init__(self,
+                 solver: ACSolver,
+                 domains: BitsetDomains,
+                 to_do=None,
+                 arc_heuristic=sat_up,
+                 split_depth=None,
+                 subtrees=None):
+        self.solver = solver
+        self.domains = domains
+        self.arc_heuristic = solver.arc_heuristic = arc_heuristic
+        self.split_depth = split_depth
+        self.subtrees = subtrees
+        self.nogoods = solver.nogoods = NogoodStore(solver.max_nogoods)
+        self.stack = []
+        self.decisions = []
+        self.done = False
+        self.nodes = 0
+        self.peak_depth = 0
+        self.peak_trail = 0
+        self.estimated_peak_bytes = 0
+        self._root = domains.mark()
+        # The node to propagate next, as its to-do's (None for all the
+        # arcs), or _NO_NODE when a result is to be passed to the top frame
+        self._node = to_do
+        self._result = None
+
+    def run(self, max_nodes=None, deadline=None):
+        """Searches until the next solution
+
+        Args:
+            max_nodes: The number of nodes after which to pause
+            deadline: A time.monotonic() value after which to pause
+
+        Returns:
+            A solution as a {variable : value} dictionary, or None if the
+            search is done or paused (see the done attribute)
+        """
+        solver = self.solver
+        domains = self.domains
+        stats = solver.stats
+        nodes = 0
+        while not self.done:
+            if self._node is _NO_NODE:
+                self._return(self._result)
+                continue
+            if solver.stop_event is not None and solver.stop_event.is_set():
+                self.close()
+                return None
+            if (max_nodes is not None and nodes >= max_nodes) or (
+                    deadline is not None and time.monotonic() > deadline):
+                return None
+
+            to_do, self._node = self._node, _NO_NODE
+            nodes += 1
+            self.nodes += 1
+            mark = domains.mark()
+            consistency, _, checks = solver.GAC(domains, to_do,
+                                                self.arc_heuristic)
+            stats['checks'] += checks
+            self._measure()
+            if not consistency:
+                stats['dead_ends'] += 1
+                self._result = domains.reason(solver.last_conflict.scope)
+                domains.undo(mark)
+                continue
+            nogood = self.nogoods.find(domains)
+            if nogood is not None:
+                stats['nogood_prunes'] += 1
+                self._result = domains.reason(var for var, _ in nogood)
+                domains.undo(mark)
+                continue
+            if all(domains.size(var) == 1 for var in domains):
+                solution = {var: first(domains[var]) for var in domains}
+                self._result = None
+                domains.undo(mark)
+                return solution
+
+            var = solver.variable_ordering(solver, domains)
+            halves = [
+                domains.encode(var, half) for half in partition_domain(
+                    solver.value_ordering(solver, var, domains))
+            ]
+            stats['splits'] += 1
+            level = len(self.decisions)
+            depth = self.split_depth
+            if self.stack and depth is not None:
+                depth = self.stack[-1]['depth'] - 1
+            self.stack.append({
+                'mark': mark,
+                'var': var,
+                'level': level,
+                'depth': depth,
+                'halves': halves[::-1],
+                'to_do': solver.new_to_do(var, None),
+                'conflict': 0,
+            })
+            self._descend()
+        return None
+
+    def _descend(self):
+        """Searches the next half of the split of the top frame"""
+        frame = self.stack[-1]
+        domains = self.domains
+        var = frame['var']
+        frame['split_mark'] = domains.mark()
+        domains.set_bits(var, frame['halves'].pop(), 1 << frame['level'])
+        self.decisions.append((var, domains.bits[var]))
+        self.peak_depth = max(self.peak_depth, len(self.stack))
+        if self.subtrees is not None and frame['depth'] is not None \
+                and frame['depth'] <= 1:
+            self.subtrees.append((domains.copy(), var))
+            self._result = None
         else:
-            var = first(x for x in self.csp.variables
-                        if len(new_domains[x]) > 1)
-            if var:
-                dom1, dom2 = partition_domain(new_domains[var])
-                new_doms1 = extend(new_domains, var, dom1)
-                new_doms2 = extend(new_domains, var, dom2)
-                to_do = self.new_to_do(var, None)
-                return self.domain_splitting(new_doms1, to_do, arc_heuristic) or \
-                       self.domain_splitting(new_doms2, to_do, arc_heuristic)
+            self._node = frame['to_do']
+
+    def _return(self, result):
+        """Passes the result of a subtree to the split it is a half of
+
+        result is the bitmask of the levels of the decisions the failure of
+        the subtree depends on, or None if it had solutions or was not
+        searched.
+        """
+        domains = self.domains
+        while True:
+            if not self.stack:
+                self.done = True
+                return
+            frame = self.stack[-1]
+            level = frame['level']
+            self.decisions.pop()
+            domains.undo(frame['split_mark'])
+            if result is None:
+                frame['conflict'] = None
+            elif not result >> level & 1 and frame['conflict'] is not None:
+                self.solver.stats['backjumps'] += 1
+                self._pop(frame)
+                continue
+            elif frame['conflict'] is not None:
+                frame['conflict'] |= result
+
+            if frame['halves']:
+                self._descend()
+                return
+
+            result = frame['conflict']
+            if result is not None:
+                # Both halves failed: the failure depends on what they
+                # depended on, except this split, and on what the split
+                # domain did
+                result = result & ~(1 << level) | domains.reasons[frame['var']]
+                self.nogoods.add(self.decisions[l] for l in range(level)
+                                 if result >> l & 1)
+            self._pop(frame)
+
+    def _pop(self, frame):
+        self.stack.pop()
+        self.domains.undo(frame['mark'])
+
+    def _measure(self):
+        trail = len(self.domains.trail) - self._root
+        self.peak_trail = max(self.peak_trail, trail)
+        self.estimated_peak_bytes = max(
+            self.estimated_peak_bytes, trail * self.TRAIL_ENTRY_BYTES +
+            len(self.stack) * self.FRAME_BYTES)
+        stats = self.solver.stats
+        stats['estimated_peak_bytes'] = max(stats['estimated_peak_bytes'],
+                                            self.estimated_peak_bytes)
+
+    def close(self):
+        """Ends the search, restoring the domains to their state on entry"""
+        self.stack.clear()
+        self.decisions.clear()
+        self.domains.undo(self._root)
+        self.done = True
+
+
+# The solver of a parallel_domain_splitting worker process
+_worker_solver = None
+
+
+def _init_split_worker(solver: ACSolver, stop_event):
+    """Initializes a forked worker with the solver and the shared stop event"""
+    global _worker_solver
+    _worker_solver = solver
+    _worker_solver.stop_event = stop_event
+
+
+def _split_subtree(domains, var, arc_heuristic):
+    """Searches one subtree in a worker of parallel_domain_splitting"""
+    if _worker_solver.stop_event.is_set():
+        return False
+    to_do = _worker_solver.new_to_do(var, None)
+    return _worker_solver.domain_splitting(domains, to_do, arc_heuristic)
+
+
+class ChainSolver:
+    """Solves a harmonizer CSP beat by beat, without domain splitting
+
+    Every constraint of a SimpleHarmonizerCSP covers one beat or two adjacent
+    beats, so the CSP is a chain. The solver enumerates the voicings of each
+    beat that satisfy its one-beat constraints, then makes a Viterbi-style
+    forward pass that keeps the voicings reachable from the previous beat
+    (with a back-pointer to one compatible voicing) and reads a solution
+    back from the last beat. The time is linear in the number of beats.
+
+    Attributes:
+        csp: The CSP problem to be solved. It must have parts.
+        beats: A list with the tuple of variables of each beat
+        beat_constraints: For each beat, the constraints within it
+        transition_constraints: For each pair of beats i and i + 1, the
+            constraints that span both
+        matrices: Whether to check transitions with vectorized compatibility
+            matrices (see transitions) instead of pair by pair
+        checks: The number of constraint evaluations done by the matrices
+    """
+    def __init__(self, csp: NaryCSP, matrices=True):
+        self.csp = csp
+        self.matrices = matrices
+        self.checks = 0
+        parts = list(csp.parts.values())
+        self.beats = [tuple(part[i] for part in parts)
+                      for i in range(len(parts[0]))]
+        beat_of = {var: i for i, beat in enumerate(self.beats) for var in beat}
+
+        self.beat_constraints = [[] for _ in self.beats]
+        self.transition_constraints = [[] for _ in self.beats[1:]]
+        for con in csp.constraints:
+            touched = sorted({beat_of[var] for var in con.scope})
+            if len(touched) == 1:
+                self.beat_constraints[touched[0]].append(con)
+            elif len(touched) == 2 and touched[1] == touched[0] + 1:
+                self.transition_constraints[touched[0]].append(con)
+            else:
+                raise ValueError(f'{con} does not fit in two adjacent beats')
+        # Check the cheap constraints first
+        for cons in self.beat_constraints + self.transition_constraints:
+            cons.sort(key=lambda con: len(con.scope))
+
+    def voicings(self, i: int, domains) -> list:
+        """Returns the voicings of beat i that satisfy its constraints
+
+        If the CSP has precomputed voicings (like SimpleHarmonizerCSP), they
+        are used as the candidates instead of the product of the domains.
+
+        Args:
+            i: The index of the beat
+            domains: A {variable : domain} dictionary
+
+        Returns:
+            A list of tuples of values, one per variable of the beat
+        """
+        beat = self.beats[i]
+        precomputed = getattr(self.csp, 'voicings', None)
+        if precomputed is not None:
+            candidates = (voicing for voicing in precomputed[i]
+                          if all(val in domains[var]
+                                 for var, val in zip(beat, voicing)))
+        else:
+            candidates = itertools.product(*(domains[var] for var in beat))
+        valid = []
+        for voicing in candidates:
+            env = dict(zip(beat, voicing))
+            if all(con.holds(env) for con in self.beat_constraints[i]):
+                valid.append(voicing)
+        return valid
+
+    def compatible(self, i: int, voicing1: tuple, voicing2: tuple) -> bool:
+        """Returns True if voicings of beats i and i + 1 can follow each other"""
+        env = dict(zip(self.beats[i], voicing1))
+        env.update(zip(self.beats[i + 1], voicing2))
+        return all(con.holds(env) for con in self.transition_constraints[i])
+
+    def transition_matrix(self, i: int, voicings1, voicings2) -> np.ndarray:
+        """Returns the compatibility matrix between voicings of beats i and i + 1
+
+        Entry [j, k] is True if voicings1[j] can be followed by voicings2[k]
+        (see transitions.TransitionBuilder).
+        """
+        builder = TransitionBuilder(self.beats[i], self.beats[i + 1],
+                                    voicings1, voicings2)
+        matrix = builder.matrix(self.transition_constraints[i])
+        self.checks += builder.checks
+        return matrix
+
+    def forward(self, domains):
+        """Computes the voicings and the voicings reachable from the first beat
+
+        Returns:
+            A tuple of the list of voicings of each beat, the list of
+            compatibility matrices and the list of boolean vectors of the
+            reachable voicings of each beat
+        """
+        voicings = [self.voicings(i, domains) for i in range(len(self.beats))]
+        matrices = []
+        reachable = [np.ones(len(voicings[0]), dtype=bool)]
+        for i in range(len(self.beats) - 1):
+            matrix = self.transition_matrix(i, voicings[i], voicings[i + 1])
+            matrices.append(matrix)
+            reachable.append((matrix & reachable[i][:, None]).any(axis=0))
+        return voicings, matrices, reachable
+
+    def propagate(self, domains=None):
+        """Reduces the domains to the values that are part of a solution
+
+        The forward pass keeps the voicings reachable from the first beat,
+        and a backward pass over the same matrices keeps those that can
+        also reach the last beat.
+
+        Args:
+            domains: A {variable : domain} dictionary (the CSP's domains if
+                not given)
+
+        Returns:
+            A tuple of whether there is a solution and the reduced
+            {variable : set} dictionary
+        """
+        if domains is None:
+            domains = self.csp.domains
+        voicings, matrices, alive = self.forward(domains)
+        for i in range(len(matrices) - 1, -1, -1):
+            alive[i] &= (matrices[i] & alive[i + 1][None, :]).any(axis=1)
+        new_domains = {}
+        for beat, beat_voicings, beat_alive in zip(self.beats, voicings,
+                                                   alive):
+            kept = [v for v, a in zip(beat_voicings, beat_alive) if a]
+            for j, var in enumerate(beat):
+                new_domains[var] = {voicing[j] for voicing in kept}
+        return all(a.any() for a in alive), new_domains
+
+    def solve(self, domains=None):
+        """Finds a solution to the CSP
+
+        Args:
+            domains: A {variable : domain} dictionary (the CSP's domains if
+                not given), e.g. domains already reduced by GAC
+
+        Returns:
+            A solution to the CSP or False if there are no solutions
+        """
+        if domains is None:
+            domains = self.csp.domains
+        if self.matrices:
+            return self._solve_matrices(domains)
+
+        reachable = self.voicings(0, domains)
+        back_pointers = []
+        for i in range(len(self.beats) - 1):
+            pointers = {}
+            for voicing in self.voicings(i + 1, domains):
+                previous = first(v for v in reachable
+                                 if self.compatible(i, v, voicing))
+                if previous is not None:
+                    pointers[voicing] = previous
+            if not pointers:
+                return False
+            back_pointers.append(pointers)
+            reachable = list(pointers)
+        if not reachable:
+            return False
+
+        voicing = reachable[0]
+        solution = dict(zip(self.beats[-1], voicing))
+        for i in range(len(self.beats) - 2, -1, -1):
+            voicing = back_pointers[i][voicing]
+            solution.update(zip(self.beats[i], voicing))
+        return solution
+
+    def _solve_matrices(self, domains):
+        """solve using the compatibility matrices for the forward pass"""
+        voicings, matrices, reachable = self.forward(domains)
+        if not reachable[-1].any():
+            return False
+        k = int(np.argmax(reachable[-1]))
+        solution = dict(zip(self.beats[-1], voicings[-1][k]))
+        for i in range(len(matrices) - 1, -1, -1):
+            k = int(np.argmax(matrices[i][:, k] & reachable[i]))
+            solution.update(zip(self.beats[i], voicings[i][k]))
+        return solution
+
+
+class StreamingSolver(ChainSolver):
+    """Harmonizes a progression whose numerals arrive one at a time
+
+    The forward pass of the ChainSolver only looks back, so the voicings of
+    a beat reachable from the first one do not depend on the beats after
+    it, except through the PAC constraint, which only holds on the last two
+    beats. The solver keeps the voicings, the compatibility matrices without
+    the PAC constraint and the reachable voicings of every beat. Appending
+    a beat then computes its voicings and one matrix, and the PAC is only
+    checked on the new last two beats. A new solution can change the
+    voicings of any beat that is not committed; beats older than window are
+    committed to the voicing they had when they left it (they have already
+    been played), so each append does an amount of work bounded by window.
+
+    Attributes:
+        window: The number of last beats whose voicings may still change
+            (at least 1), or None to never commit a beat
+        committed: The number of beats committed so far
+        played: The {variable : value} assignment of the committed beats
+        beat_voicings: The voicings of each beat (after committing, only the
+            committed voicing is left)
+        free_matrices: The compatibility matrices between beats i and i + 1
+            without the PAC constraint
+        reachable: The boolean vectors of the voicings of each beat that
+            are reachable from the first beat without the PAC constraint
+        solution: The last solution found, or False
+    """
+    def __init__(self, csp: NaryCSP, window=None):
+        super().__init__(csp)
+        self.window = window
+        self.committed = 0
+        self.played = {}
+        self.beat_voicings = [
+            self.voicings(i, csp.domains) for i in range(len(self.beats))
+        ]
+        self.free_matrices = []
+        self.reachable = [np.ones(len(self.beat_voicings[0]), dtype=bool)]
+        for i in range(len(self.beats) - 1):
+            self._extend(i)
+        self.solution = self._solve_tail()
+
+    def append(self, numeral: str):
+        """Appends a beat to the CSP and harmonizes the new progression
+
+        Once the progression has no solution even without the PAC (no
+        voicing of the last beat is reachable from the first beat), there
+        is nothing to commit the oldest beats to: they are kept, so the
+        window grows, and this and every later append return False. The
+        work per append stays bounded, since only the new matrix is built.
+
+        Args:
+            numeral: The roman numeral of the new beat (as a string)
+
+        Returns:
+            A solution to the whole CSP, or False if there is none
+        """
+        i = len(self.beats) - 1
+        self.csp.append_beat(numeral)
+        self.beats.append(tuple(part[-1] for part in self.csp.parts.values()))
+        beat_of = {var: j for j, beat in enumerate(self.beats[-3:], i - 1)
+                   for var in beat}
+        self.beat_constraints.append([])
+        self.transition_constraints[-1] = []
+        self.transition_constraints.append([])
+        for con in set().union(*(self.csp.variables_to_constraints[var]
+                                 for var in self.beats[-2] + self.beats[-1])):
+            touched = sorted({beat_of[var] for var in con.scope})
+            if touched == [i + 1]:
+                self.beat_constraints[-1].append(con)
+            elif touched == [i, i + 1]:
+                self.transition_constraints[-1].append(con)
+            elif touched == [i - 1, i]:
+                self.transition_constraints[-2].append(con)
+        for cons in (self.beat_constraints[-1],
+                     *self.transition_constraints[-2:]):
+            cons.sort(key=lambda con: len(con.scope))
+
+        self.beat_voicings.append(self.voicings(i + 1, self.csp.domains))
+        self._extend(i)
+        if self.window is not None:
+            while len(self.beats) - self.committed > self.window:
+                # Without a cadence yet, commit to a solution without the PAC
+                solution = self.solution or self._solve_tail(pac=False)
+                if not solution:
+                    # No voicing of the last beat is reachable, so there is
+                    # nothing to commit to and the window grows
+                    break
+                self._commit(self.committed, solution)
+        self.solution = self._solve_tail()
+        return self.solution
+
+    def _split_pac(self, i: int) -> tuple:
+        """Returns the (free, PAC) constraints between beats i and i + 1"""
+        free, pac = [], []
+        for con in self.transition_constraints[i]:
+            rest, rule = split_rule(con, 'is_pac')
+            if rest is not None:
+                free.append(rest)
+            if rule is not None:
+                pac.append(rule)
+        return free, pac
+
+    def _extend(self, i: int):
+        """Computes the free matrix and the reachable voicings of beat i + 1"""
+        builder = TransitionBuilder(self.beats[i], self.beats[i + 1],
+                                    self.beat_voicings[i],
+                                    self.beat_voicings[i + 1])
+        matrix = builder.matrix(self._split_pac(i)[0])
+        self.checks += builder.checks
+        self.free_matrices.append(matrix)
+        self.reachable.append((matrix & self.reachable[i][:, None]).any(axis=0))
+
+    def _commit(self, i: int, solution):
+        """Keeps only the voicing beat i has in a solution
+
+        The reachable voicings of the beats after it are recomputed, which
+        only goes as far as the window.
+        """
+        voicing = tuple(solution[var] for var in self.beats[i])
+        k = self.beat_voicings[i].index(voicing)
+        self.played.update(zip(self.beats[i], voicing))
+        self.beat_voicings[i] = [voicing]
+        self.reachable[i] = np.ones(1, dtype=bool)
+        if i > 0:
+            self.free_matrices[i - 1] = self.free_matrices[i - 1][:, k:k + 1]
+        self.free_matrices[i] = self.free_matrices[i][k:k + 1]
+        for j in range(i, len(self.beats) - 1):
+            self.reachable[j + 1] = (self.free_matrices[j] &
+                                     self.reachable[j][:, None]).any(axis=0)
+        self.committed += 1
+
+    def _solve_tail(self, pac=True):
+        """Reads a solution back from the last beat to the committed ones
+
+        Args:
+            pac: Whether the last two beats must be a PAC
+        """
+        n = len(self.beats)
+        last = self.free_matrices[-1]
+        if pac:
+            builder = TransitionBuilder(self.beats[-2], self.beats[-1],
+                                        self.beat_voicings[-2],
+                                        self.beat_voicings[-1])
+            last = last & builder.matrix(self._split_pac(n - 2)[1])
+            self.checks += builder.checks
+        reachable = (last & self.reachable[-2][:, None]).any(axis=0)
+        if not reachable.any():
+            return False
+        k = int(np.argmax(reachable))
+        tail = dict(zip(self.beats[-1], self.beat_voicings[-1][k]))
+        for i in range(n - 2, max(self.committed - 1, 0) - 1, -1):
+            matrix = last if i == n - 2 else self.free_matrices[i]
+            k = int(np.argmax(matrix[:, k] & self.reachable[i]))
+            tail.update(zip(self.beats[i], self.beat_voicings[i][k]))
+        return {**self.played, **tail}
 
 
 class ACSearchSolver(search.Problem):
     """A search problem with generalized arcy consistency and domain splitting
 
+    States are PersistentDomains, so a state shares all the domains its
+    split and propagation did not change with its parent.
+
     Attributes:
         csp: An instance of an NaryCSP
         cons: An instance of ACSolver seeded with the csp
         heuristic: A function meant to be used as the heuristic
-        domains: The dictionary mapping variables to their domains
+        domains: The PersistentDomains mapping variables to their domains
     """
-    def __init__(self, csp: NaryCSP, arc_heuristic=sat_up, debug=False):
+    def __init__(self,
+                 csp: NaryCSP,
+                 arc_heuristic=sat_up,
+                 debug=False,
+                 variable_ordering=input_order,
+                 value_ordering=pitch_order):
         self.csp = csp
-        self.acsolver = ACSolver(csp)
+        self.acsolver = ACSolver(csp, variable_ordering, value_ordering)
         consistent, domains, checks = self.acsolver.GAC(
             arc_heuristic=arc_heuristic, debug=debug)
         if not consistent:
             raise Exception('CSP is inconsistent')
 
-        self.domains = domains
+        self.domains = PersistentDomains(domains)
         self.heuristic = arc_heuristic
         super().__init__(self.domains)
 
     def goal_test(self, node) -> bool:
         """Node is a goal if all domains have 1 element"""
-        return all(len(node[var]) == 1 for var in node)
+        return node is not None and all(len(node[var]) == 1 for var in node)
 
     def actions(self, state):
-        """Enumerate all actions for a certain state"""
-        var = first(x for x in state if len(state[x]) > 1)
-        neighs = []
-        if var:
-            domain1, domain2 = partition_domain(state[var])
-            to_do = self.acsolver.new_to_do(var, None)
-            for d in [domain1, domain2]:
-                new_domains = extend(state, var, d)
-                consistent, cons_domains, checks = self.acsolver.GAC(
-                    new_domains, to_do, self.heuristic)
-                if consistent:
-                    neighs.append(cons_domains)
-        return neighs
+        """Enumerate all actions for a certain state
+
+        The actions are the halves of a split of the next variable's domain.
+        They are listed second half first, since depth_first_tree_search
+        searches the last action first.
+        """
+        if state is None:
+            return []
+        var = self.acsolver.variable_ordering(self.acsolver, state)
+        if not var:
+            return []
+        halves = partition_domain(
+            self.acsolver.value_ordering(self.acsolver, var, state))
+        return [(var, d) for d in reversed(halves)]
 
     def result(self, state, action):
-        """Return the result of taking an action in a state"""
-        return action
+        """Return the arc-consistent domains after taking an action
+
+        Propagation only runs when the search gets to the child, so the
+        second half of a split is never propagated if the first half leads
+        to a solution. An inconsistent result is None.
+        """
+        var, d = action
+        consistent, cons_domains, checks = self.acsolver.GAC(
+            state.set(var, d), self.acsolver.new_to_do(var, None),
+            self.heuristic)
+        self.acsolver.stats['checks'] += checks
+        return cons_domains.persistent() if consistent else None
 
     def search_solve(self):
-        """Find solution using depth-first search"""
-        solution = None
-        try:
-            solution = depth_first_tree_search(self).state
-        except Exception as e:
-            print(f'Exception raised in ACSearchSolver: {e}')
-            return solution
-        if solution:
-            return {var: first(solution[var]) for var in solution}
+        """Find solution using depth-first search
+
+        Returns:
+            A {variable : value} dictionary, or None if there is no solution
+        """
+        node = search.depth_first_tree_search(self)
+        if node is None:
+            return None
+        return {var: first(node.state[var]) for var in node.state}
 
 
 if __name__ == '__main__':
+    from display import show_sovler_solution
+    from theory import Key
+
     shcsp = SimpleHarmonizerCSP(
         name='Test',
         notes=8,
@@ -0,0 +1,109 @@
+"""Extensional (table) constraints
+
+A constraint can be compiled once into the table of tuples it allows over
+the current domains. ACSolver.GAC then revises table constraints with
+simple tabular reduction (STR): the rows that are still valid are found
+with NumPy array operations instead of calling the condition per tuple.
+"""
+import itertools
+import numpy as np
+from constraints import Constraint
+
+# Constraints whose domains have a larger Cartesian product are left as
+# they are, since compiling them would cost more than it saves
+MAX_TABLE_ROWS = 20000
+
+
+class TableConstraint(Constraint):
+    """A constraint given by the table of tuples it allows
+
+    Attributes:
+        scope: A tuple of variables
+        condition: The original condition the table was compiled from
+        values: A tuple with, for each variable of the scope, the tuple of
+            values the table columns index into
+        table: An (allowed tuples x len(scope)) array of value indices
+    """
+    def __init__(self, scope, condition, values, table):
+        super().__init__(scope, condition)
+        self.values = values
+        self.table = table
+
+    def __repr__(self):
+        return f'table:{self.condition.__name__}{self.scope}'
+
+    def valid_rows(self, domains, rows=None):
+        """Returns the rows of the table whose values are all in the domains
+
+        Args:
+            domains: A {variable : domain} dictionary
+            rows: The row indices to filter (all rows if None)
+
+        Returns:
+            An array of row indices
+        """
+        table = self.table if rows is None else self.table[rows]
+        valid = np.ones(len(table), dtype=bool)
+        for col, var in enumerate(self.scope):
+            domain = domains[var]
+            in_domain = np.fromiter((v in domain for v in self.values[col]),
+                                    dtype=bool,
+                                    count=len(self.values[col]))
+            if not in_domain.all():
+                valid &= in_domain[table[:, col]]
+        indices = np.flatnonzero(valid)
+        return indices if rows is None else rows[indices]
+
+    def supported_values(self, rows, var):
+        """Returns the set of values of var that appear in the given rows"""
+        col = self.scope.index(var)
+        values = self.values[col]
+        return {values[i] for i in np.unique(self.table[rows, col])}
+
+
+def compile_table(con: Constraint, domains, max_rows=MAX_TABLE_ROWS):
+    """Compiles a constraint into a TableConstraint over the domains
+
+    Args:
+        con: The constraint to compile
+        domains: A {variable : domain} dictionary
+        max_rows: The largest Cartesian product of domains to enumerate
+
+    Returns:
+        The TableConstraint, or None if the domains are too large
+    """
+    values = tuple(tuple(domains[var]) for var in con.scope)
+    size = 1
+    for vals in values:
+        size *= len(vals)
+    if size > max_rows:
+        return None
+
+    rows = [
+        index for index in itertools.product(*(range(len(vals))
+                                               for vals in values))
+        if con.condition(*(vals[i] for vals, i in zip(values, index)))
+    ]
+    table = np.array(rows, dtype=np.int16).reshape(len(rows), len(values))
+    return TableConstraint(con.scope, con.condition, values, table)
+
+
+def compile_tables(constraints: list, domains, max_rows=MAX_TABLE_ROWS):
+    """Compiles every constraint that is small enough into a table
+
+    Args:
+        constraints: A list of constraints
+        domains: A {variable : domain} dictionary
+        max_rows: The largest Cartesian product of domains to enumerate
+
+    Returns:
+        A new list of constraints where the compiled ones are replaced
+        by TableConstraints
+    """
+    compiled = []
+    for con in constraints:
+        table = None
+        if not isinstance(con, TableConstraint):
+            table = compile_table(con, domains, max_rows)
+        compiled.append(table or con)
+    return compiled
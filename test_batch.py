@@ -0,0 +1,52 @@
+import json
+from batch import harmonize, harmonize_stream, read_records
+from pitches import parse_note_value as Note
+
+
+class TestBatch:
+    def test_harmonize_record(self):
+        result = harmonize({'id': 'a', 'numerals': ['I', 'IV', 'V', 'I'],
+                            'key': 'E'})
+        assert result['id'] == 'a'
+        assert set(result['solution']) == {
+            f'{p}{i}' for p in 'satb' for i in range(1, 5)
+        }
+        assert result['stats']['solver'] == 'chain'
+
+    def test_error_is_reported(self):
+        result = harmonize({'id': 'b', 'numerals': ['I', 'Q']})
+        assert result['solution'] is None
+        assert 'error' in result
+
+    def test_partial_ranges(self):
+        result = harmonize({'id': 'c', 'numerals': ['I', 'V', 'I'],
+                            'ranges': {'s': ['C5', 'C6']}})
+        assert 'error' not in result
+        assert all(72 <= Note(result['solution'][f's{i}']).midi <= 84
+                   for i in range(1, 4))
+
+    def test_non_object_record(self):
+        result = harmonize([1, 2])
+        assert result['id'] is None and 'error' in result
+
+    def test_bad_lines_on_the_pool(self):
+        lines = [
+            json.dumps({'id': 0, 'numerals': ['I', 'V', 'I']}), '{"id": 1,',
+            '[1, 2]', '"x"',
+            json.dumps({'id': 4, 'numerals': ['I', 'IV', 'V', 'I']})
+        ]
+        results = list(harmonize_stream(read_records(lines), workers=2))
+        assert [r['id'] for r in results] == [0, None, None, None, 4]
+        assert [r.get('line') for r in results[1:4]] == [2, 3, 4]
+        assert results[1]['error'].startswith('JSONDecodeError')
+        assert results[2]['error'].startswith('TypeError')
+        assert results[0]['solution'] and results[4]['solution']
+        assert all(json.loads(json.dumps(r)) == r for r in results)
+
+    def test_stream_keeps_input_order(self):
+        lines = [
+            json.dumps({'id': i, 'numerals': ['I', 'V', 'I']})
+            for i in range(3)
+        ] + ['']
+        results = list(harmonize_stream(read_records(lines), workers=0))
+        assert [r['id'] for r in results] == [0, 1, 2]
@@ -1,10 +1,23 @@
+import itertools
 import pytest
-from csp import no_parallel_fifths, no_parallel_octaves
-from music21.note import Note
+import csp
+from pitches import parse_note_value as Note
+from theory import Key, parse_numeral
+
+
+# Run every test against the integer kernel and the music21 reference
+@pytest.fixture(params=[csp.no_parallel_fifths, csp.no_parallel_fifths_m21])
+def no_parallel_fifths(request):
+    return request.param
+
+
+@pytest.fixture(params=[csp.no_parallel_octaves, csp.no_parallel_octaves_m21])
+def no_parallel_octaves(request):
+    return request.param
 
 
 class TestParallelFifths:
-    def test_no_parallel_fiths_false(self):
+    def test_no_parallel_fiths_false(self, no_parallel_fifths):
         s1 = Note('C5')
         s2 = Note('D5')
         a1 = Note('F4')
@@ -15,7 +28,7 @@ class TestParallelFifths:
         b2 = Note('D3')
         assert not no_parallel_fifths(s1, a1, t1, b1, s2, a2, t2, b2)
 
-    def test_no_parallel_fiths_true(self):
+    def test_no_parallel_fiths_true(self, no_parallel_fifths):
         s1 = Note('C5')
         s2 = Note('D5')
         a1 = Note('F4')
@@ -24,7 +37,7 @@ class TestParallelFifths:
 
 
 class TestParallelOctaves:
-    def test_no_parallel_octaves_false(self):
+    def test_no_parallel_octaves_false(self, no_parallel_octaves):
         s1 = Note('C5')
         s2 = Note('D5')
         a1 = Note('F4')
@@ -35,7 +48,7 @@ class TestParallelOctaves:
         b2 = Note('D3')
         assert not no_parallel_octaves(s1, a1, t1, b1, s2, a2, t2, b2)
 
-    def test_no_parallel_octaves_true(self):
+    def test_no_parallel_octaves_true(self, no_parallel_octaves):
         s1 = Note('C5')
         s2 = Note('D5')
         a1 = Note('F4')
@@ -46,9 +59,122 @@ class TestParallelOctaves:
         b2 = Note('F3')
         assert no_parallel_octaves(s1, a1, t1, b1, s2, a2, t2, b2)
 
-    def test_no_parallel_octaves_same_note(self):
+    def test_no_parallel_octaves_same_note(self, no_parallel_octaves):
         s1 = Note('C5')
         s2 = Note('C5')
         a1 = Note('C4')
         a2 = Note('C4')
         assert no_parallel_octaves(s1, a1, s2, a2)
+
+
+class TestEvaluationCache:
+    def test_hits_and_misses(self):
+        cache = csp.EvaluationCache()
+        con = csp.Constraint(('s1', 's2'), csp.different_notes, cache)
+        c4, d4 = Note('C4'), Note('D4')
+        assert con.holds({'s1': c4, 's2': d4})
+        assert not con.holds({'s1': c4, 's2': c4})
+        assert con.holds({'s1': c4, 's2': d4})
+        assert (cache.hits, cache.misses, len(cache)) == (1, 2, 2)
+
+    def test_lru_eviction_under_memory_cap(self):
+        cache = csp.EvaluationCache(max_bytes=0)
+        cache.max_bytes = 2 * cache.entry_size((csp.different_notes, (1, 2)))
+        for values in [(1, 2), (3, 4), (1, 2), (5, 6)]:
+            cache.evaluate(csp.different_notes, values)
+        assert cache.evictions == 1
+        assert cache.nbytes <= cache.max_bytes
+        # (3, 4) was the least recently used entry
+        cache.evaluate(csp.different_notes, (1, 2))
+        cache.evaluate(csp.different_notes, (3, 4))
+        assert cache.hits == 2 and cache.misses == 4
+
+
+class TestPartialChecks:
+    def test_never_rule_out_a_solution(self):
+        from solver import ACSolver
+        problem = csp.SimpleHarmonizerCSP('Test',
+                                          3, ['I', 'V', 'I'],
+                                          decompose_constraints=False)
+        partials = [c for c in problem.constraints if c.partial is not None]
+        assert {n for c in partials for n in csp.rule_names(c)} >= {
+            'is_pac', 'no_parallel_fifths', 'no_parallel_octaves'
+        }
+        for solution in ACSolver(problem).iter_solutions(limit=5):
+            for con in partials:
+                for n in range(len(con.scope) + 1):
+                    for assigned in itertools.combinations(con.scope, n):
+                        assert con.partial_holds(
+                            {v: solution[v] for v in assigned})
+
+    def test_rule_out_partial_assignments(self):
+        different = csp.all_notes_different_one_beat.partial
+        assert different(Note('C4'), None, Note('E4'))
+        assert not different(Note('C4'), None, Note('C4'))
+        root_and_third = csp.require_root_and_third(
+            parse_numeral('I', Key('C'))).partial
+        g4 = Note('G4')
+        assert root_and_third(Note('E4'), g4, g4, None)
+        assert not root_and_third(g4, g4, g4, None)
+
+
+class TestDecompose:
+    def test_quartet_scopes(self):
+        scope = ('s1', 'a1', 't1', 'b1', 's2', 'a2', 't2', 'b2')
+        con = csp.Constraint(scope, csp.no_parallel_fifths)
+        other = csp.Constraint(scope[4:], csp.all_notes_different_one_beat)
+        decomposed = csp.decompose([con, other])
+        assert decomposed[-1] is other
+        assert [c.scope for c in decomposed[:-1]] == [
+            (scope[i], scope[i + 1], scope[4 + j], scope[5 + j])
+            for i in range(3) for j in range(3)
+        ]
+        assert all(c.condition is csp.no_parallel_fifths_quartet
+                   for c in decomposed[:-1])
+
+    def test_same_solutions(self):
+        problems = [
+            csp.SimpleHarmonizerCSP('Test',
+                                    2, ['V', 'I'],
+                                    decompose_constraints=decompose,
+                                    fuse_constraints=False)
+            for decompose in (True, False)
+        ]
+        solutions = []
+        for problem in problems:
+            variables = [var for i in range(2)
+                         for var in (part[i] for part in problem.parts.values())]
+            solutions.append({
+                voicing1 + voicing2
+                for voicing1, voicing2 in itertools.product(*problem.voicings)
+                if problem.consistent(
+                    dict(zip(variables, voicing1 + voicing2)))
+            })
+        assert solutions[0] == solutions[1]
+        assert 0 < len(solutions[0]) < len(problems[0].voicings[0]) * len(
+            problems[0].voicings[1])
+
+
+class TestFuse:
+    def test_same_scope_constraints_become_one(self):
+        problem = csp.SimpleHarmonizerCSP('Test',
+                                          2, ['V', 'I'],
+                                          decompose_constraints=False,
+                                          fuse_constraints=False)
+        fused = csp.fuse(problem.constraints)
+        assert len({c.scope for c in fused}) == len(fused) < len(
+            problem.constraints)
+        assert sorted(n for c in fused for n in csp.rule_names(c)) == sorted(
+            c.condition.__name__ for c in problem.constraints)
+        c5, e5, g4 = Note('C5'), Note('E5'), Note('G4')
+        assert csp.Conjunction([csp.different_notes]) == csp.Conjunction(
+            [csp.different_notes])
+        both = csp.Conjunction([csp.different_notes, lambda a, b: a < b])
+        assert both(c5, e5) and not both(e5, c5) and not both(g4, g4)
+
+    def test_display_lists_every_rule(self, capsys):
+        csp.SimpleHarmonizerCSP('Test', 2, ['V', 'I']).display()
+        s1 = next(line for line in capsys.readouterr().out.splitlines()
+                  if line.startswith('s1: ') and 'different' in line)
+        assert {'all_notes_different_one_beat', 'mandate_root_and_third',
+                'different_notes'} <= set(s1[4:].split(', '))
@@ -0,0 +1,72 @@
+from music21.key import Key
+from csp import SimpleHarmonizerCSP
+from pitches import parse_note_value as Note
+from solutions import SolutionCache, problem_key
+from solver import ChainSolver
+
+
+def chain_solve(csp):
+    return ChainSolver(csp).solve()
+
+
+class TestSolutionCache:
+    def test_problem_key(self):
+        csp = SimpleHarmonizerCSP('A', 3, ['I', 'V', 'I'], key=Key('E'))
+        same = SimpleHarmonizerCSP('B', 3, ['I', 'V', 'I'], key=Key('E'))
+        assert problem_key(csp) == problem_key(same)
+        other_key = SimpleHarmonizerCSP('A', 3, ['I', 'V', 'I'], key=Key('F'))
+        assert problem_key(csp) != problem_key(other_key)
+        ranges = dict(csp.ranges, s=(Note('A4'), Note('G5')))
+        other_ranges = SimpleHarmonizerCSP('A',
+                                           3, ['I', 'V', 'I'],
+                                           key=Key('E'),
+                                           ranges=ranges)
+        assert problem_key(csp) != problem_key(other_ranges)
+        csp.remove_rule('is_pac')
+        assert problem_key(csp) != problem_key(same)
+
+    def test_repeat_is_a_hit(self, tmp_path):
+        csp = SimpleHarmonizerCSP('A', 4, ['I', 'IV', 'V', 'I'], key=Key('G'))
+        cache = SolutionCache(str(tmp_path / 'solutions.db'))
+        solution = cache.solve(csp, chain_solve)
+        assert solution and csp.consistent(solution)
+        assert cache.solve(csp, chain_solve) == solution
+        assert (cache.hits, cache.misses) == (1, 1)
+
+        # The solutions outlive the connection
+        cache.close()
+        cache = SolutionCache(str(tmp_path / 'solutions.db'))
+        assert cache.solve(csp, lambda csp: None) == solution
+        assert cache.hit_rate == 1.0
+
+    def test_no_solution_is_cached(self):
+        csp = SimpleHarmonizerCSP('A', 3, ['I', 'IV', 'I'])
+        cache = SolutionCache()
+        assert cache.solve(csp, chain_solve) is False
+        assert cache.solve(csp, lambda csp: None) is False
+        assert cache.hits == 1
+
+    def test_eviction(self):
+        cache = SolutionCache(max_bytes=500)
+        solution = {f'{p}1': Note('C4') for p in 'satb'}
+        for i in range(20):
+            cache.put(str(i), solution)
+        assert cache.evictions > 0
+        assert cache.nbytes <= 500
+        assert cache.get('19')[0]
+        assert not cache.get('0')[0]
+
+    def test_lookups_do_not_write(self):
+        cache = SolutionCache(max_bytes=500)
+        solution = {f'{p}1': Note('C4') for p in 'satb'}
+        for i in range(10):
+            cache.put(str(i), solution)
+        changes = cache._db.total_changes
+        assert cache.get('0')[0]
+        assert cache._db.total_changes == changes
+        assert not cache._db.in_transaction
+
+        # The use is written with the next put, so '0' outlives '1'
+        cache.put('10', solution)
+        assert cache.get('0')[0]
+        assert not cache.get('1')[0]
@@ -0,0 +1,556 @@
+from music21.key import Key
+from csp import NaryCSP, SimpleHarmonizerCSP
+import itertools
+import os
+import random
+import subprocess
+import sys
+import pytest
+from solver import (ACSolver, ACSearchSolver, ChainSolver, StreamingSolver,
+                    partition_domain, sat_up)
+from constraints import Constraint, no_parallel_fifths, rule_names
+from tables import TableConstraint
+from domains import BitsetDomains
+from worklist import ArcWorklist
+from ordering import VALUE_ORDERINGS, VARIABLE_ORDERINGS
+from nogoods import NogoodStore
+from persistent import PersistentDomains
+from search import Problem, depth_first_tree_search
+
+
+def harmonizer(numerals, key='C', pac=False):
+    """A SimpleHarmonizerCSP, by default without the (slow) PAC constraint"""
+    csp = SimpleHarmonizerCSP('Test', len(numerals), numerals, key=Key(key))
+    if not pac:
+        csp.remove_rule('is_pac')
+    return csp
+
+
+class TestTables:
+    def test_gac_same_domains_with_tables(self):
+        numerals = ['I', 'IV', 'viio', 'iii', 'vi', 'ii', 'V7', 'I']
+        consistent, domains, _ = ACSolver(harmonizer(numerals, 'E')).GAC()
+        csp = harmonizer(numerals, 'E')
+        csp.compile_tables()
+        assert any(isinstance(c, TableConstraint) for c in csp.constraints)
+        table_consistent, table_domains, _ = ACSolver(csp).GAC()
+        assert consistent == table_consistent
+        assert {v: set(d) for v, d in domains.items()} == table_domains
+
+    def test_tables_are_revised_once_per_change(self, monkeypatch):
+        csp = harmonizer(['I', 'IV', 'viio', 'iii', 'vi', 'ii', 'V7', 'I'])
+        csp.compile_tables()
+        tables = [c for c in csp.constraints if isinstance(c, TableConstraint)]
+        revised = []
+        revise_table = ACSolver.revise_table
+
+        def counting(self, domains, const, *args):
+            revised.append(const)
+            return revise_table(self, domains, const, *args)
+
+        monkeypatch.setattr(ACSolver, 'revise_table', counting)
+        assert ACSolver(csp).GAC()[0]
+        # Not once per variable in the scope of each table
+        assert len(revised) < sum(len(c.scope) for c in tables)
+        assert set(revised) == set(tables)
+
+    def test_table_solution_is_consistent(self):
+        csp = harmonizer(['I', 'vi', 'ii', 'V'], 'G')
+        csp.compile_tables()
+        solution = ACSolver(csp).domain_splitting()
+        assert solution
+        assert csp.consistent(solution)
+
+
+class TestResidues:
+    def test_supports_are_reused_across_calls(self):
+        csp = harmonizer(['I', 'IV', 'V', 'I'])
+        solver = ACSolver(csp)
+        _, first, first_checks = solver.GAC()
+        assert solver.residues
+        _, again, checks = solver.GAC()
+
+        solver.residues.clear()
+        _, cleared, cleared_checks = solver.GAC()
+        assert again == cleared == first
+        assert checks < cleared_checks == first_checks
+
+
+class TestIterSolutions:
+    def test_distinct_consistent_solutions(self):
+        csp = harmonizer(['I', 'V', 'I'])
+        solutions = list(ACSolver(csp).iter_solutions(limit=25))
+        assert len(solutions) == 25
+        assert all(csp.consistent(s) for s in solutions)
+        assert len({tuple(sorted(s.items())) for s in solutions}) == 25
+
+    def test_first_solution_matches_domain_splitting(self):
+        csp = harmonizer(['I', 'ii', 'V', 'I'], 'F')
+        first = next(ACSolver(csp).iter_solutions())
+        assert first == ACSolver(csp).domain_splitting()
+
+    def test_exhausts_and_restores_domains(self):
+        csp = harmonizer(['I', 'V'], 'D')
+        domains = BitsetDomains(csp.domains)
+        solver = ACSolver(csp)
+        solutions = list(solver.iter_solutions(domains))
+        assert solutions and not domains.trail
+        assert list(solver.iter_solutions(time_budget=0)) == []
+
+
+class TestParallelSplitting:
+    def test_solution_is_consistent(self):
+        csp = harmonizer(['I', 'vi', 'V'], 'G')
+        solution = ACSolver(csp).parallel_domain_splitting(split_depth=2,
+                                                           max_workers=2)
+        assert solution and csp.consistent(solution)
+
+
+class TestBitsetDomains:
+    def test_undo_restores_domains(self):
+        domains = BitsetDomains({'x': [1, 2, 3], 'y': [4, 5]})
+        mark = domains.mark()
+        domains['x'] = {1, 3}
+        domains['y'] = {5}
+        assert domains['x'] == {1, 3} and domains.size('y') == 1
+        domains.undo(mark)
+        assert domains.copy() == {'x': {1, 2, 3}, 'y': {4, 5}}
+
+    def test_splitting_leaves_domains_unchanged(self):
+        csp = harmonizer(['I', 'IV', 'V', 'I'])
+        domains = BitsetDomains(csp.domains)
+        before = domains.copy()
+        solution = ACSolver(csp).domain_splitting(domains)
+        assert solution and csp.consistent(solution)
+        assert domains.copy() == before and not domains.trail
+
+
+class TestPersistentDomains:
+    def test_set_shares_structure(self):
+        domains = PersistentDomains({f'v{i}': {i, i + 1} for i in range(40)})
+        changed = domains.set('v3', {3})
+        assert domains['v3'] == {3, 4} and changed['v3'] == {3}
+        assert dict(changed) == dict(domains, v3={3})
+        shared = [a is b for a, b in zip(domains._leaves, changed._leaves)]
+        assert shared.count(False) == 1
+
+    def test_evolver(self):
+        domains = PersistentDomains({'x': {1, 2}, 'y': {3}})
+        evolver = domains.copy()
+        evolver['x'] = {1}
+        assert domains['x'] == {1, 2}
+        assert evolver.persistent() == {'x': {1}, 'y': {3}}
+
+
+class TestLazySearch:
+    def test_children_are_built_when_popped(self):
+        built = []
+
+        class Counting(Problem):
+            def actions(self, state):
+                return [state * 2 + 1, state * 2]
+
+            def result(self, state, action):
+                built.append(action)
+                return action
+
+            def goal_test(self, state):
+                return state == 4
+
+        node = depth_first_tree_search(Counting(1))
+        assert node.state == 4
+        assert built == [2, 4]
+
+    def test_search_solver_states(self):
+        csp = harmonizer(['I', 'ii', 'V', 'I'], 'B-')
+        problem = ACSearchSolver(csp)
+        node = depth_first_tree_search(problem)
+        assert isinstance(node.state, PersistentDomains)
+        solution = {var: next(iter(node.state[var])) for var in node.state}
+        assert csp.consistent(solution)
+
+
+class TestArcWorklist:
+    def test_pops_by_arity_without_duplicates(self):
+        csp = harmonizer(['I', 'V'])
+        arcs = [(v, c) for c in csp.constraints for v in c.scope]
+        worklist = ArcWorklist(arcs)
+        worklist.update(arcs)
+        assert len(worklist) == len(set(arcs))
+        popped = [worklist.pop() for _ in range(len(worklist))]
+        arities = [len(c.scope) for _, c in popped]
+        assert arities == sorted(arities)
+        assert not worklist and popped[0] not in worklist
+
+    def test_discarded_arcs_are_skipped(self):
+        csp = harmonizer(['I', 'V'])
+        arcs = [(v, c) for c in csp.constraints for v in c.scope]
+        worklist = ArcWorklist(arcs)
+        worklist.discard(arcs[0])
+        worklist.discard(arcs[0])
+        assert len(worklist) == len(arcs) - 1 and arcs[0] not in worklist
+        assert arcs[0] not in list(worklist)
+        # Queued again, it is popped once
+        worklist.add(arcs[0])
+        popped = [worklist.pop() for _ in range(len(worklist))]
+        assert len(popped) == len(arcs) and set(popped) == set(arcs)
+        assert not worklist
+
+
+class TestOrderings:
+    def test_partition_domain_is_deterministic(self):
+        assert partition_domain({5, 1, 4, 2, 3}) == ({1, 2}, {3, 4, 5})
+        assert partition_domain([5, 1, 4, 2]) == ({5, 1}, {4, 2})
+
+    @pytest.mark.parametrize('variable', VARIABLE_ORDERINGS)
+    @pytest.mark.parametrize('value', VALUE_ORDERINGS)
+    def test_orderings_find_solutions(self, variable, value):
+        csp = harmonizer(['I', 'vi', 'V', 'I'], 'D')
+        solver = ACSolver(csp, VARIABLE_ORDERINGS[variable],
+                          VALUE_ORDERINGS[value])
+        solution = solver.domain_splitting()
+        assert solution and csp.consistent(solution)
+        assert solver.stats['variable_ordering'] == \
+            VARIABLE_ORDERINGS[variable].__name__
+        assert solver.stats['value_ordering'] == VALUE_ORDERINGS[value].__name__
+
+    def test_search_solver_uses_orderings(self):
+        csp = harmonizer(['I', 'IV', 'V', 'I'], 'F')
+        problem = ACSearchSolver(csp,
+                                 variable_ordering=VARIABLE_ORDERINGS['mrv'],
+                                 value_ordering=VALUE_ORDERINGS['closest'])
+        solution = problem.search_solve()
+        assert solution and csp.consistent(solution)
+
+    def test_wipeouts_are_weighted(self):
+        # No PAC can end on IV - I
+        csp = harmonizer(['I', 'IV', 'I'], pac=True)
+        solver = ACSolver(csp)
+        assert solver.domain_splitting() is False
+        assert solver.last_conflict is not None
+        assert solver.weights[solver.last_conflict] > 1
+
+    def test_least_constraining_probes_leave_no_trace(self):
+        csp = harmonizer(['I', 'IV', 'I'], pac=True)
+        solver = ACSolver(csp)
+        used = []
+
+        def heuristic(to_do):
+            used.append(len(to_do))
+            return sat_up(to_do)
+
+        solver.arc_heuristic = heuristic
+        var = csp.parts['s'][-1]
+        order = VALUE_ORDERINGS['lcv'](solver, var, csp.domains)
+        assert sorted(order) == sorted(csp.domains[var]) and used
+        # Every value wipes out, since there is no PAC from IV
+        assert solver.weights == {} and solver.last_conflict is None
+
+
+def different(a, b):
+    return a != b
+
+
+def random_csp(seed):
+    """A small CSP with random binary and ternary table-like constraints"""
+    rng = random.Random(seed)
+    variables = [f'v{i}' for i in range(7)]
+    domains = {v: list(range(rng.randint(2, 4))) for v in variables}
+    constraints = []
+    for _ in range(rng.randint(4, 12)):
+        scope = tuple(rng.sample(variables, rng.choice([2, 3])))
+        allowed = {
+            values
+            for values in itertools.product(*(domains[v] for v in scope))
+            if rng.random() < 0.6
+        }
+        constraints.append(
+            Constraint(scope, lambda *values, allowed=allowed: values in allowed))
+    csp = NaryCSP(domains, constraints)
+    csp.variables = variables
+    return csp
+
+
+class TestLearning:
+    def test_backjumps_over_irrelevant_splits(self):
+        # Three pigeons in two holes, which GAC on the binary constraints
+        # cannot see, behind eight variables that are split first
+        free = [f'x{i}' for i in range(8)]
+        holes = ['p1', 'p2', 'p3']
+        domains = {v: [0, 1, 2, 3] for v in free}
+        domains.update({v: [0, 1] for v in holes})
+        constraints = [
+            Constraint((a, b), different)
+            for a, b in itertools.combinations(holes, 2)
+        ]
+        constraints += [
+            Constraint((a, b), different) for a, b in zip(free, free[1:])
+        ]
+        csp = NaryCSP(domains, constraints)
+        csp.variables = free + holes
+        solver = ACSolver(csp)
+        assert solver.domain_splitting() is False
+        assert solver.stats['backjumps'] > 0
+        assert solver.stats['splits'] < 30
+
+    @pytest.mark.parametrize('seed', range(40))
+    def test_all_solutions_are_found(self, seed):
+        csp = random_csp(seed)
+        variables = csp.variables
+        expected = {
+            values
+            for values in itertools.product(*(csp.domains[v]
+                                              for v in variables))
+            if all(
+                con.holds(dict(zip(variables, values)))
+                for con in csp.constraints)
+        }
+        for variable_ordering in VARIABLE_ORDERINGS.values():
+            solver = ACSolver(csp, variable_ordering, max_nogoods=seed % 5)
+            found = [
+                tuple(solution[v] for v in variables)
+                for solution in solver.iter_solutions()
+            ]
+            assert len(found) == len(expected)
+            assert set(found) == expected
+
+    def test_nogood_store(self):
+        domains = BitsetDomains({'x': [1, 2, 3], 'y': [4, 5]})
+        nogoods = NogoodStore(max_size=2)
+        nogoods.add([('x', 0b011), ('x', 0b110), ('y', 0b01)])
+        assert nogoods.find(domains) is None
+        domains['x'] = {2}
+        domains['y'] = {4}
+        assert nogoods.find(domains) == (('x', 0b010), ('y', 0b01))
+        nogoods.add([('y', 0b10)])
+        nogoods.add([('x', 0b100)])
+        assert len(nogoods) == 2 and nogoods.evictions == 1
+
+    def test_reasons_are_undone(self):
+        domains = BitsetDomains({'x': [1, 2, 3], 'y': [4, 5]})
+        mark = domains.mark()
+        domains.restrict('x', {1, 2}, 0b1)
+        domains.restrict('y', {4}, domains.reason(['x']) | 0b10)
+        assert domains.reasons == {'x': 0b1, 'y': 0b11}
+        domains.undo(mark)
+        assert domains.reasons == {'x': 0, 'y': 0}
+
+
+class TestSplitSearch:
+    def test_pause_and_resume(self):
+        csp = harmonizer(['I', 'ii', 'V', 'I'], 'A')
+        expected = ACSolver(csp).domain_splitting()
+        search = ACSolver(csp).split_search()
+        pauses = 0
+        solution = search.run(max_nodes=1)
+        while solution is None and not search.done:
+            pauses += 1
+            solution = search.run(max_nodes=1)
+        assert pauses > 1
+        assert solution == expected
+        assert search.peak_depth > 0 and search.estimated_peak_bytes > 0
+
+    def test_search_is_not_recursive(self):
+        # Deeper than the recursion limit allows for one frame per split
+        numerals = ['I', 'IV', 'V', 'I'] * 75
+        csp = harmonizer(numerals)
+        solver = ACSolver(csp)
+        solution = solver.domain_splitting()
+        assert solution and csp.consistent(solution)
+        assert solver.stats['splits'] > sys.getrecursionlimit()
+
+    def test_search_solver_result(self):
+        csp = harmonizer(['I', 'IV', 'I'])
+        solution = ACSearchSolver(csp).search_solve()
+        assert set(solution) == set(csp.variables)
+        assert csp.consistent(solution)
+
+    def test_search_solver_is_a_problem(self):
+        results = []
+
+        class Recording(ACSearchSolver):
+            def result(self, state, action):
+                results.append(action)
+                return super().result(state, action)
+
+        csp = harmonizer(['I', 'V', 'I'])
+        solution = Recording(csp).search_solve()
+        assert results and csp.consistent(solution)
+
+
+class TestChainSolver:
+    def test_solution_is_consistent(self):
+        csp = harmonizer(['I', 'IV', 'V', 'I'], pac=True)
+        solution = ChainSolver(csp).solve()
+        assert solution and csp.consistent(solution)
+
+    def test_long_progression(self):
+        numerals = ['I', 'IV', 'ii', 'V', 'vi', 'iii', 'IV', 'V'] * 8 + ['I']
+        csp = harmonizer(numerals, 'D')
+        solution = ChainSolver(csp).solve()
+        assert solution and csp.consistent(solution)
+
+    def test_matrices_match_pairwise_checks(self):
+        csp = harmonizer(['ii', 'V7', 'I'], 'B-', pac=True)
+        # An 8-ary constraint too, as with decompose_constraints=False
+        csp.constraints += [
+            Constraint(c.scope, no_parallel_fifths) for c in csp.constraints
+            if 'is_pac' in rule_names(c)
+        ]
+        csp.index_constraints()
+        chain = ChainSolver(csp)
+        for i in range(2):
+            voicings1 = chain.voicings(i, csp.domains)
+            voicings2 = chain.voicings(i + 1, csp.domains)
+            matrix = chain.transition_matrix(i, voicings1, voicings2)
+            assert matrix.any() and not matrix.all()
+            for j, v1 in enumerate(voicings1):
+                for k, v2 in enumerate(voicings2):
+                    assert matrix[j, k] == chain.compatible(i, v1, v2)
+
+    def test_propagate_keeps_solution_values(self):
+        csp = harmonizer(['I', 'vi', 'IV', 'V', 'I'], pac=True)
+        consistent, domains = ChainSolver(csp).propagate()
+        assert consistent
+        solution = ChainSolver(csp).solve(domains)
+        assert solution and csp.consistent(solution)
+        assert all(domains[v] <= set(csp.domains[v]) for v in domains)
+
+    def test_no_solution(self):
+        # There can be no perfect authentic cadence from IV
+        csp = harmonizer(['I', 'IV', 'I'], pac=True)
+        assert ChainSolver(csp).solve() is False
+
+
+class TestStreaming:
+    NUMERALS = ['I', 'vi', 'IV', 'V', 'I', 'ii', 'V7', 'vi', 'IV', 'V', 'I']
+
+    def test_append_beat_keeps_the_pac_constraint(self):
+        csp = SimpleHarmonizerCSP('Test', 2, self.NUMERALS[:2])
+        numerals = csp.numerals
+        for numeral in self.NUMERALS[2:5]:
+            csp.append_beat(numeral)
+            assert [c for c in csp.constraints
+                    if 'is_pac' in rule_names(c)] == [csp.pac_constraint]
+            assert f's{csp.notes}' in csp.pac_constraint.scope
+        assert csp.numerals is numerals
+        csp.remove_rule('is_pac')
+        assert csp.pac_constraint is None
+
+    @pytest.mark.parametrize('decompose', [True, False])
+    def test_append_beat_matches_building_outright(self, decompose):
+        csp = SimpleHarmonizerCSP('Test', 2, self.NUMERALS[:2],
+                                  decompose_constraints=decompose)
+        for numeral in self.NUMERALS[2:]:
+            csp.append_beat(numeral)
+        built = SimpleHarmonizerCSP('Test', len(self.NUMERALS), self.NUMERALS,
+                                    decompose_constraints=decompose)
+
+        def rules(constraints):
+            return sorted((c.scope, rule_names(c)) for c in constraints)
+
+        assert rules(csp.constraints) == rules(built.constraints)
+        assert csp.domains == built.domains
+        assert {v: rules(cons) for v, cons in
+                csp.variables_to_constraints.items()} == {
+                    v: rules(cons)
+                    for v, cons in built.variables_to_constraints.items()
+                }
+
+    def test_solutions_match_chain_solver(self):
+        streaming = StreamingSolver(
+            SimpleHarmonizerCSP('Test', 2, self.NUMERALS[:2]))
+        for n, numeral in enumerate(self.NUMERALS[2:], 3):
+            solution = streaming.append(numeral)
+            csp = SimpleHarmonizerCSP('Test', n, self.NUMERALS[:n])
+            assert bool(solution) == bool(ChainSolver(csp).solve())
+            assert not solution or (csp.consistent(solution)
+                                    and len(solution) == len(csp.variables))
+
+    def test_window_keeps_played_beats(self):
+        streaming = StreamingSolver(
+            SimpleHarmonizerCSP('Test', 2, self.NUMERALS[:2]), window=3)
+        for numeral in self.NUMERALS[2:]:
+            played = dict(streaming.played)
+            solution = streaming.append(numeral)
+            assert len(streaming.beats) - streaming.committed <= 3
+            assert streaming.played.items() >= played.items()
+            if solution:
+                assert solution.items() >= streaming.played.items()
+        assert solution and streaming.csp.consistent(solution)
+
+
+class TestPartialChecks:
+    def test_same_domains_with_fewer_checks(self):
+        csp = SimpleHarmonizerCSP('Test',
+                                  3, ['I', 'V', 'I'],
+                                  decompose_constraints=False)
+        consistent, domains, checks = ACSolver(csp).GAC()
+        # The same conditions without their partial checks
+        csp.constraints = [
+            Constraint(c.scope, lambda *notes, f=c.condition: f(*notes))
+            for c in csp.constraints
+        ]
+        csp.index_constraints()
+        assert not any(c.partial for c in csp.constraints)
+        full_consistent, full_domains, full_checks = ACSolver(csp).GAC()
+        assert consistent and full_consistent
+        assert domains == full_domains
+        assert checks < full_checks
+
+
+class TestFusedConstraints:
+    def test_same_domains_with_fewer_checks(self):
+        numerals = ['I', 'IV', 'V', 'I']
+        consistent, domains, checks = ACSolver(harmonizer(numerals)).GAC()
+        csp = SimpleHarmonizerCSP('Test',
+                                  len(numerals),
+                                  numerals,
+                                  fuse_constraints=False)
+        csp.remove_rule('is_pac')
+        unfused = ACSolver(csp).GAC()
+        assert (consistent, domains) == unfused[:2]
+        assert checks < unfused[2]
+
+    def test_remove_fused_rule(self):
+        # Without decomposition the PAC is fused with the parallel rules
+        csp = SimpleHarmonizerCSP('Test', 3, ['I', 'IV', 'I'],
+                                  decompose_constraints=False)
+        assert ChainSolver(csp).solve() is False
+        count = len(csp.constraints)
+        csp.remove_rule('is_pac')
+        assert len(csp.constraints) == count
+        assert not any('is_pac' in rule_names(c) for c in csp.constraints)
+        solution = ChainSolver(csp).solve()
+        assert solution and csp.consistent(solution)
+
+
+class TestStartup:
+    CWD = os.path.dirname(os.path.abspath(__file__))
+
+    def run(self, script: str) -> str:
+        return subprocess.run([sys.executable, '-c', script], cwd=self.CWD,
+                              capture_output=True, text=True,
+                              check=True).stdout
+
+    def test_solving_does_not_import_music21(self):
+        self.run("""
+import sys
+import batch, csp, solutions, solver, transposition
+assert 'music21' not in sys.modules
+shcsp = csp.SimpleHarmonizerCSP('Test', 4, ['I', 'IV', 'V', 'I'])
+s = solver.ACSolver(shcsp)
+assert s.GAC()[0] and s.domain_splitting()
+assert 'music21' not in sys.modules
+""")
+
+    def test_import_time(self, record_property):
+        # Recorded for comparison (about 0.1s, against about 0.25s for
+        # music21 alone) rather than asserted, since it depends on the machine
+        elapsed = self.run("""
+import time
+start = time.perf_counter()
+import batch, csp, solutions, solver, transposition
+print(time.perf_counter() - start)
+""")
+        record_property('import_seconds', float(elapsed))
@@ -0,0 +1,108 @@
+import pytest
+from music21.key import Key
+from music21.interval import Interval
+from music21.pitch import Pitch
+from constraints import rule_names
+from csp import SimpleHarmonizerCSP
+from pitches import parse_note_value as Note, transpose
+from solutions import SolutionCache
+from solver import ChainSolver
+from transposition import (KeyNormalizer, canonical_key, key_interval,
+                           widened_ranges)
+from voicings import VoicingTables
+
+KEYS = ['C', 'D-', 'C#', 'D', 'E-', 'E', 'F', 'F#', 'G-', 'G', 'A-', 'A',
+        'B-', 'B', 'C-', 'a', 'e', 'b-', 'g#', 'd#']
+
+
+class TestTranspose:
+    @pytest.mark.parametrize('key', KEYS)
+    def test_key_interval_spells_the_tonic(self, key):
+        key = Key(key)
+        tonic = transpose(Note('C4'), *key_interval(key))
+        assert tonic.name == key.tonic.name
+        assert abs(tonic.midi - 60) <= 6
+
+    def test_matches_music21_spelling(self):
+        for name in ['C4', 'F#3', 'B-4', 'E#5', 'G--2']:
+            for interval in ['m3', '-M3', 'A4', '-d5', 'P8', 'A1']:
+                generic = Interval(interval).generic.directed
+                steps = generic - 1 if generic > 0 else generic + 1
+                value = transpose(Note(name), steps,
+                                  Interval(interval).semitones)
+                expected = Pitch(name).transpose(interval)
+                assert value.nameWithOctave == expected.nameWithOctave
+
+
+class TestKeyNormalizer:
+    def test_solutions_in_every_key(self):
+        normalizer = KeyNormalizer(lambda csp: ChainSolver(csp).solve())
+        for key in KEYS:
+            numerals = ['I', 'IV', 'V', 'I'] if key[0].isupper() else \
+                ['i', 'iv', 'V', 'i']
+            csp = SimpleHarmonizerCSP('Test', 4, numerals, key=Key(key))
+            solution = normalizer.solve(csp)
+            assert solution and csp.consistent(solution)
+            assert all(v in csp.domains[var] for var, v in solution.items())
+        assert normalizer.transposed > 0
+
+    def test_no_fallbacks(self):
+        normalizer = KeyNormalizer(lambda csp: ChainSolver(csp).solve())
+        for key in ['D', 'E', 'F', 'G', 'A', 'B-', 'E-', 'A-', 'e', 'g#']:
+            numerals = ['I', 'IV', 'V', 'I'] if key[0].isupper() else \
+                ['i', 'iv', 'V', 'i']
+            csp = SimpleHarmonizerCSP('Test', 4, numerals, key=Key(key))
+            solution = normalizer.solve(csp)
+            assert solution and csp.consistent(solution)
+        assert normalizer.fallbacks == 0
+        assert normalizer.transposed == 10
+
+    def test_solutions_are_shared_between_keys(self):
+        cache = SolutionCache()
+        normalizer = KeyNormalizer(lambda csp: ChainSolver(csp).solve(),
+                                   cache)
+        for key in ['D', 'E']:
+            csp = SimpleHarmonizerCSP('Test',
+                                      4, ['I', 'IV', 'V', 'I'],
+                                      key=Key(key))
+            solution = normalizer.solve(csp)
+            assert solution and csp.consistent(solution)
+        assert (cache.hits, cache.misses) == (1, 1)
+        assert normalizer.shared == 1
+
+    def test_voicing_tables_are_shared_between_keys(self):
+        tables = VoicingTables()
+        for key in ['D', 'E']:
+            csp = SimpleHarmonizerCSP('Test',
+                                      3, ['I', 'V', 'I'],
+                                      key=Key(key),
+                                      voicing_tables=tables)
+            misses = tables.misses
+            csp.transposed(canonical_key(csp.key),
+                           table_ranges=widened_ranges(csp.ranges))
+        # The canonical CSP of E found the tables of the one of D
+        assert tables.misses == misses
+
+    @pytest.mark.parametrize('key', KEYS)
+    def test_filtered_voicings(self, key):
+        numerals = ['I', 'V', 'I'] if key[0].isupper() else ['i', 'V', 'i']
+        csp = SimpleHarmonizerCSP('Test', 3, numerals, key=Key(key))
+        canonical = csp.transposed(canonical_key(csp.key),
+                                   table_ranges=widened_ranges(csp.ranges))
+        assert canonical.voicings == csp.transposed(
+            canonical_key(csp.key)).voicings
+
+    def test_transposed_ranges(self):
+        csp = SimpleHarmonizerCSP('Test', 3, ['I', 'V', 'I'], key=Key('D'))
+        canonical = csp.transposed(canonical_key(csp.key))
+        assert canonical.ranges['s'] == (Note('F4'), Note('F5'))
+        assert canonical.transposed(csp.key).ranges['s'] == (Note('G4'),
+                                                             Note('G5'))
+
+    def test_transposed_keeps_the_rules(self):
+        csp = SimpleHarmonizerCSP('Test', 3, ['I', 'V', 'I'], key=Key('E'))
+        csp.remove_rule('is_pac')
+        canonical = csp.transposed(canonical_key(csp.key))
+        assert canonical.key.tonic.name == 'C'
+        assert not any('is_pac' in rule_names(c)
+                       for c in canonical.constraints)
@@ -0,0 +1,82 @@
+import itertools
+import random
+import pytest
+from music21.voiceLeading import VoiceLeadingQuartet
+from music21.key import Key
+from constraints import (no_parallel_fifths, no_parallel_octaves,
+                         no_parallel_fifths_m21, no_parallel_octaves_m21)
+from csp import SimpleHarmonizerCSP
+from pitches import note_value, parse_note_value, shared_note
+from voiceleading import parallel_fifth, parallel_octave
+
+NATURALS = ['C', 'D', 'E', 'F', 'G', 'A', 'B']
+SPELLINGS = NATURALS + [n + '#' for n in NATURALS] + [n + '-' for n in NATURALS]
+
+SATB_RANGES = {
+    's': ('G4', 'G5'),
+    'a': ('C4', 'D5'),
+    't': ('E3', 'G4'),
+    'b': ('C2', 'C4')
+}
+
+
+def notes_in_range(bottom, top, names):
+    """All NoteValues with one of the names between bottom and top"""
+    bottom = parse_note_value(bottom)
+    top = parse_note_value(top)
+    return [
+        note_value(name, octave)
+        for octave in range(bottom.octave - 1, top.octave + 2)
+        for name in names
+        if bottom.midi <= note_value(name, octave).midi <= top.midi
+    ]
+
+
+def assert_quartets_match(upper, lower):
+    """Compare the kernel to music21 for every quartet of the two voices"""
+    for v1n1, v1n2 in itertools.product(upper, repeat=2):
+        for v2n1, v2n2 in itertools.product(lower, repeat=2):
+            quartet = (v1n1, v1n2, v2n1, v2n2)
+            vlq = VoiceLeadingQuartet(*(shared_note(n) for n in quartet))
+            assert parallel_fifth(*quartet) == vlq.parallelFifth(), quartet
+            assert parallel_octave(*quartet) == vlq.parallelOctave(), quartet
+
+
+class TestKernelParity:
+    @pytest.mark.parametrize('upper,lower', [('s', 'a'), ('a', 't'),
+                                             ('t', 'b')])
+    def test_adjacent_satb_ranges(self, upper, lower):
+        assert_quartets_match(notes_in_range(*SATB_RANGES[upper], NATURALS),
+                              notes_in_range(*SATB_RANGES[lower], NATURALS))
+
+    def test_enharmonic_spellings(self):
+        # Every spelling with at most one accidental, so that diminished
+        # sixths and the like are told apart from perfect fifths
+        assert_quartets_match(notes_in_range('G4', 'C5', SPELLINGS),
+                              notes_in_range('C4', 'F4', SPELLINGS))
+
+    def test_compound_and_crossed_voices(self):
+        assert_quartets_match(notes_in_range('C3', 'C3', SPELLINGS) +
+                              notes_in_range('G4', 'G4', SPELLINGS),
+                              notes_in_range('C2', 'G2', NATURALS) +
+                              notes_in_range('C5', 'G5', NATURALS))
+
+
+class TestConstraintParity:
+    @pytest.mark.parametrize('key,numerals', [
+        ('C', ['I', 'IV', 'V', 'I']),
+        ('E', ['I', 'vi', 'ii', 'V7']),
+        ('c', ['i', 'iv', 'V', 'i']),
+        ('B-', ['I', 'iii', 'viio', 'I']),
+    ])
+    def test_satb_beats(self, key, numerals):
+        csp = SimpleHarmonizerCSP('Parity', 4, numerals, key=Key(key))
+        rng = random.Random(0)
+        for i in range(1, 4):
+            scope = [f'{p}{j}' for j in (i, i + 1) for p in 'satb']
+            for _ in range(200):
+                notes = [rng.choice(csp.domains[v]) for v in scope]
+                assert no_parallel_fifths(*notes) == \
+                    no_parallel_fifths_m21(*notes)
+                assert no_parallel_octaves(*notes) == \
+                    no_parallel_octaves_m21(*notes)
@@ -0,0 +1,64 @@
+import gzip
+import itertools
+import pickle
+from music21.key import Key
+from csp import SimpleHarmonizerCSP
+from theory import parse_numeral
+from voicings import VoicingTables, notes_from_roman, bass_notes_from_roman
+
+SATB = ['s', 'a', 't', 'b']
+
+
+def product_voicings(csp, i):
+    """The voicings of beat i that satisfy the one-beat constraints"""
+    rn = parse_numeral(csp.numerals[i], csp.key)
+    domains = [notes_from_roman(*csp.ranges[p], rn) for p in SATB]
+    domains[-1] = bass_notes_from_roman(domains[-1], rn)
+    beat = [csp.parts[p][i] for p in SATB]
+    cons = [c for c in csp.constraints if set(c.scope) == set(beat)]
+    return {
+        voicing
+        for voicing in itertools.product(*domains)
+        if all(c.holds(dict(zip(beat, voicing))) for c in cons)
+    }
+
+
+class TestVoicingTables:
+    def test_tables_match_beat_constraints(self):
+        csp = SimpleHarmonizerCSP('Test', 3, ['I', 'V7', 'viio'], key=Key('A'))
+        for i in range(3):
+            assert set(csp.voicings[i]) == product_voicings(csp, i)
+
+    def test_cache_and_round_trip(self, tmp_path):
+        path = str(tmp_path / 'voicings.pkl.gz')
+        tables = VoicingTables(path)
+        csp = SimpleHarmonizerCSP('Test',
+                                  4, ['I', 'IV', 'V', 'I'],
+                                  key=Key('F'),
+                                  voicing_tables=tables)
+        assert (tables.misses, tables.hits) == (3, 1)
+        tables.save()
+
+        loaded = VoicingTables(path)
+        assert len(loaded) == 3
+        again = SimpleHarmonizerCSP('Test',
+                                    4, ['I', 'IV', 'V', 'I'],
+                                    key=Key('F'),
+                                    voicing_tables=loaded)
+        assert loaded.misses == 0
+        assert again.voicings == csp.voicings
+        assert again.domains == csp.domains
+
+    def test_other_versions_are_ignored(self, tmp_path):
+        path = str(tmp_path / 'voicings.pkl.gz')
+        tables = VoicingTables(path)
+        SimpleHarmonizerCSP('Test', 2, ['V', 'I'], voicing_tables=tables)
+        tables.save()
+        with gzip.open(path, 'rb') as f:
+            stored = pickle.load(f)
+        assert len(VoicingTables(path)) == 2
+
+        for old in (stored['tables'], dict(stored, version=(1, 1))):
+            with gzip.open(path, 'wb') as f:
+                pickle.dump(old, f)
+            assert len(VoicingTables(path)) == 0
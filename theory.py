@@ -0,0 +1,298 @@
+"""Keys, roman numerals and chord figures without music21
+
+The solving path only needs a little music theory: the notes of the roman
+numeral of each beat, and the figure of a chord for the cadence rule. Key
+and parse_numeral give the first from tables of the intervals of each
+quality, inversion and chromatic chord (spelled as music21's Key and
+RomanNumeral spell them). roman_figure names a chord by looking its pitch
+classes and bass up in a table built once per key from the same numerals,
+so both directions share one definition of each chord. music21 is only
+imported to render scores.
+"""
+import itertools
+import re
+from pitches import (STEP_INDICES, STEP_NAMES, STEP_PITCH_CLASSES, note_value,
+                     pitch_class_of, transpose)
+
+MODE_SCALES = {
+    'major': (0, 2, 4, 5, 7, 9, 11),
+    'minor': (0, 2, 3, 5, 7, 8, 10),
+}
+ROMANS = ('I', 'II', 'III', 'IV', 'V', 'VI', 'VII')
+
+_scales = {}
+
+
+def scale_alters(tonic: str, mode: str) -> tuple:
+    """Returns the alteration of each step (C to B) in the scale of a key
+
+    Minor keys use the natural minor scale, as music21 does.
+    """
+    alters = _scales.get((tonic, mode))
+    if alters is None:
+        first = STEP_INDICES[tonic[0]]
+        tonic_pc = pitch_class_of(tonic)
+        by_step = [0] * 7
+        for degree, semitones in enumerate(MODE_SCALES[mode]):
+            index = (first + degree) % 7
+            natural = STEP_PITCH_CLASSES[STEP_NAMES[index]]
+            by_step[index] = (tonic_pc + semitones - natural + 6) % 12 - 6
+        alters = _scales[tonic, mode] = tuple(by_step)
+    return alters
+
+
+def pitch_name(letter: str, alter: int) -> str:
+    """Returns the pitch name of a step letter and an alteration, like 'B-'"""
+    return letter + ('#' * alter if alter > 0 else '-' * -alter)
+
+
+class Key:
+    """A major or minor key
+
+    Has the attributes of a music21 Key that the solver reads, so either
+    can be given to the CSPs.
+
+    Attributes:
+        tonic: The NoteValue of the tonic (in octave 4)
+        mode: 'major' or 'minor'
+    """
+    def __init__(self, tonic: str, mode: str = None):
+        """Initialize the key
+
+        Args:
+            tonic: The name of the tonic, like 'E', 'B-' or 'Bb'. Without a
+                mode, a lower case name (like 'a') is a minor key.
+            mode: 'major' or 'minor'
+        """
+        if mode is None:
+            mode = 'minor' if tonic[0].islower() else 'major'
+        name = tonic[0].upper() + tonic[1:].replace('b', '-')
+        self.tonic = note_value(name, 4)
+        self.mode = mode
+
+    @property
+    def name(self) -> str:
+        return f'{self.tonic.name} {self.mode}'
+
+    def __repr__(self):
+        return f'<Key {self.name}>'
+
+    def __eq__(self, other):
+        return isinstance(other, Key) and self.name == other.name
+
+    def __hash__(self):
+        return hash(self.name)
+
+
+class Numeral:
+    """The chord of a roman numeral in a key
+
+    Attributes:
+        figure: The roman numeral, like 'V65'
+        names: The pitch names of the chord from the bass up, in the order
+            of music21's RomanNumeral.pitches
+        root: The pitch name of the root
+        third: The pitch name of the third, or None
+        bass: The pitch name of the bass
+    """
+    def __init__(self, figure, names, root, third, bass):
+        self.figure = figure
+        self.names = tuple(names)
+        self.root = root
+        self.third = third
+        self.bass = bass
+
+    def __repr__(self):
+        return f'<Numeral {self.figure} {" ".join(self.names)}>'
+
+
+# The spelled intervals above the root, as (steps, semitones), of the third
+# and fifth of each quality of triad
+QUALITIES = {
+    'major': ((2, 4), (4, 7)),
+    'minor': ((2, 3), (4, 7)),
+    'diminished': ((2, 3), (4, 6)),
+    'augmented': ((2, 4), (4, 8)),
+}
+QUALITY_MARKS = {'o': 'diminished', 'ø': 'diminished', '+': 'augmented'}
+# Sevenths set by the quality mark; other sevenths are those of the scale
+MARKED_SEVENTHS = {'o': (6, 9), 'ø': (6, 10)}
+# The chord member in the bass (0 for the root) of each inversion figure
+TRIAD_INVERSIONS = {'': 0, '6': 1, '64': 2}
+SEVENTH_INVERSIONS = {'7': 0, '65': 1, '43': 2, '42': 3}
+# Chromatic chords, as the spelled intervals above the tonic of their notes
+# from the bass up, and the indices of their root and third
+CHROMATIC_CHORDS = {
+    'N6': (((3, 5), (5, 8), (1, 1)), 2, 0),
+    'It6': (((5, 8), (0, 0), (3, 6)), 2, 0),
+    'Ger65': (((5, 8), (0, 0), (2, 3), (3, 6)), 3, 0),
+    'Fr43': (((5, 8), (0, 0), (1, 2), (3, 6)), 2, 3),
+}
+NUMERAL = re.compile(r'(b|#)?(VII|VI|V|IV|III|II|I|vii|vi|v|iv|iii|ii|i)'
+                     r'(o|ø|\+)?(\d*)')
+
+
+def parse_numeral(figure: str, key) -> Numeral:
+    """Returns the chord of a roman numeral in a key
+
+    The numeral is a front alteration (b or #), a roman numeral (upper case
+    for major, lower case for minor), a quality mark (o, ø or +) and an
+    inversion (6, 64, 7, 65, 43 or 42), optionally followed by / and the
+    numeral of a secondary key (like V7/V). Cad64 and the chromatic chords
+    N6, It6, Ger65 and Fr43 are also accepted. As in music21, minor keys
+    use the natural minor scale, except that minor and diminished chords on
+    the sixth and seventh degrees are on the raised degrees.
+
+    Args:
+        figure: The roman numeral, like 'V65'
+        key: The Key (or music21 Key) of the numeral
+
+    Raises:
+        ValueError: If the numeral is not one of those above
+    """
+    tonic, mode = key.tonic.name, key.mode
+    working, _, secondary = figure.partition('/')
+    if secondary:
+        chord = parse_numeral(secondary, key)
+        third = pitch_class_of(chord.third) - pitch_class_of(chord.root)
+        tonic = chord.root
+        mode = 'major' if third % 12 == 4 else 'minor'
+    if working == 'Cad64':
+        working = 'i64' if mode == 'minor' else 'I64'
+
+    if working in CHROMATIC_CHORDS:
+        intervals, root, third = CHROMATIC_CHORDS[working]
+        notes = [transpose(note_value(tonic, 4), *iv) for iv in intervals]
+        names = [n.name for n in notes]
+        return Numeral(figure, names, names[root], names[third], names[0])
+
+    match = NUMERAL.fullmatch(working)
+    if match is None or match.group(4) not in {**TRIAD_INVERSIONS,
+                                               **SEVENTH_INVERSIONS}:
+        raise ValueError(f'Unsupported roman numeral {figure!r}')
+    alteration, roman, mark, inversion = match.groups()
+    degree = ROMANS.index(roman.upper()) + 1
+    quality = QUALITY_MARKS.get(mark) or (
+        'major' if roman.isupper() else 'minor')
+    alter = {'b': -1, '#': 1, None: 0}[alteration]
+    if mode == 'minor' and degree in (6, 7) and roman.islower():
+        alter += 1
+
+    alters = scale_alters(tonic, mode)
+    index = (STEP_INDICES[tonic[0]] + degree - 1) % 7
+    root = note_value(pitch_name(STEP_NAMES[index], alters[index] + alter), 4)
+    members = [root] + [transpose(root, *iv) for iv in QUALITIES[quality]]
+    if inversion in SEVENTH_INVERSIONS:
+        if mark in MARKED_SEVENTHS:
+            seventh = transpose(root, *MARKED_SEVENTHS[mark])
+        else:
+            # The seventh of the scale, but minor above a minor triad
+            index = (index + 6) % 7
+            seventh = note_value(pitch_name(STEP_NAMES[index], alters[index]),
+                                 4)
+            semitones = (seventh.midi - root.midi) % 12
+            if quality == 'minor' and semitones == 11:
+                semitones = 10
+            seventh = transpose(root, 6, semitones)
+        members.append(seventh)
+        bass = SEVENTH_INVERSIONS[inversion]
+    elif mark == 'ø':
+        raise ValueError(f'Unsupported roman numeral {figure!r}')
+    else:
+        bass = TRIAD_INVERSIONS[inversion]
+
+    names = [n.name for n in members[bass:] + members[:bass]]
+    return Numeral(figure, names, members[0].name, members[1].name, names[0])
+
+
+# The quality marks each case of numeral is enumerated with in the figure
+# tables, for triads and for sevenths
+TRIAD_MARKS = {True: ('', '+'), False: ('', 'o')}
+SEVENTH_MARKS = {True: ('', ), False: ('', 'o', 'ø')}
+# The numerals secondary chords of the figure tables lead to in each mode,
+# and the secondary chords
+SECONDARY_TARGETS = {
+    'major': ('ii', 'iii', 'IV', 'V', 'vi'),
+    'minor': ('III', 'iv', 'V', 'VI', 'VII'),
+}
+SECONDARY_CHORDS = ('V', 'V7', 'viio7')
+
+_figure_tables = {}
+
+
+def table_figures(mode: str):
+    """Yields the figures of the figure table of a mode, the preferred first
+
+    Unaltered numerals come first, then the secondary dominants and leading
+    tone sevenths, the chromatic chords and the numerals with a front
+    alteration. Within those, triads come before sevenths, and root
+    positions before inversions (so a diminished seventh chord, which has
+    the pitch classes of its inversions, is named from its bass).
+    """
+    for alteration in ('', 'b', '#'):
+        for inversions, marks in ((TRIAD_INVERSIONS, TRIAD_MARKS),
+                                  (SEVENTH_INVERSIONS, SEVENTH_MARKS)):
+            for inversion in inversions:
+                for roman in ROMANS:
+                    for numeral in (roman, roman.lower()):
+                        for mark in marks[numeral.isupper()]:
+                            yield alteration + numeral + mark + inversion
+        if not alteration:
+            for chord in SECONDARY_CHORDS:
+                inversions = SEVENTH_INVERSIONS if chord[-1] == '7' else \
+                    TRIAD_INVERSIONS
+                for inversion in inversions:
+                    for target in SECONDARY_TARGETS[mode]:
+                        yield f'{chord.rstrip("7")}{inversion}/{target}'
+            yield from CHROMATIC_CHORDS
+
+
+def figure_table(key) -> dict:
+    """Returns the figures of the chords of a key by their pitch classes
+
+    The table is built once per key from parse_numeral. Each chord is
+    entered with every subset of its notes that has its root, third and
+    bass, and a set of pitch classes keeps the first figure of
+    table_figures that has it.
+
+    Args:
+        key: The Key (or music21 Key)
+
+    Returns:
+        A {(frozenset of pitch classes, bass pitch class) : figure}
+        dictionary
+    """
+    cache_key = (key.tonic.name, key.mode)
+    table = _figure_tables.get(cache_key)
+    if table is None:
+        table = _figure_tables[cache_key] = {}
+        for figure in table_figures(key.mode):
+            chord = parse_numeral(figure, key)
+            pcs = {pitch_class_of(name) for name in chord.names}
+            bass = pitch_class_of(chord.bass)
+            required = {pitch_class_of(chord.root),
+                        pitch_class_of(chord.third), bass}
+            others = sorted(pcs - required)
+            for size in range(len(others) + 1):
+                for subset in itertools.combinations(others, size):
+                    table.setdefault((frozenset(required.union(subset)), bass),
+                                     figure)
+    return table
+
+
+def roman_figure(notes, key):
+    """Returns the roman numeral figure of a chord in a key, like 'V65'
+
+    Args:
+        notes: A sequence of NoteValues (in any voice order). The lowest
+            note is the bass.
+        key: The Key (or music21 Key)
+
+    Returns:
+        The figure from the figure_table of the key, or None if the chord
+        is not in it
+    """
+    if not notes:
+        return None
+    bass = min(notes, key=lambda n: n.midi)
+    return figure_table(key).get((frozenset(n.pc for n in notes), bass.pc))
@@ -0,0 +1,133 @@
+"""Compatibility matrices between the voicings of adjacent beats
+
+For two beats with voicing lists V1 and V2, the compatibility matrix is the
+boolean (len(V1), len(V2)) array whose entry [i, j] says whether V1[i] can
+be followed by V2[j] under the constraints spanning both beats. The known
+two-beat conditions are evaluated in one vectorized pass over the semitone
+and step arrays of the voicings; conditions that are a conjunction of one
+condition per beat (like is_pac) are evaluated once per voicing; any other
+condition falls back to one call per pair. Fused conjunctions are split back
+into their conditions.
+"""
+import numpy as np
+from constraints import (QUARTET_DECOMPOSITIONS, Conjunction, Constraint,
+                         decompose, different_notes,
+                         no_parallel_fifths_quartet,
+                         no_parallel_octaves_quartet)
+from voiceleading import parallel_fifth_array, parallel_octave_array
+
+
+def note_arrays(voicings, width: int) -> tuple:
+    """Returns the (midi, step) arrays of shape (len(voicings), width)"""
+    midi = np.array([[n.midi for n in v] for v in voicings],
+                    dtype=np.int16).reshape(len(voicings), width)
+    step = np.array([[n.step for n in v] for v in voicings],
+                    dtype=np.int16).reshape(len(voicings), width)
+    return midi, step
+
+
+# Conditions with an elementwise version over notes given as (midi, step)
+# pairs of arrays
+VECTORIZED = {
+    no_parallel_fifths_quartet:
+    lambda u1, l1, u2, l2: ~parallel_fifth_array(u1, u2, l1, l2),
+    no_parallel_octaves_quartet:
+    lambda u1, l1, u2, l2: ~parallel_octave_array(u1, u2, l1, l2),
+    different_notes:
+    lambda n1, n2: (n1[0] != n2[0]) | (n1[1] != n2[1]),
+}
+
+
+class TransitionBuilder:
+    """Builds compatibility matrices between the voicings of two beats
+
+    Attributes:
+        beat1: The tuple of variables of the first beat
+        beat2: The tuple of variables of the second beat
+        voicings1: The voicings of the first beat (tuples in beat1 order)
+        voicings2: The voicings of the second beat (tuples in beat2 order)
+        checks: The number of pairs or voicings the conditions were
+            evaluated on (a vectorized condition counts once per pair)
+    """
+    def __init__(self, beat1, beat2, voicings1, voicings2):
+        self.beat1 = beat1
+        self.beat2 = beat2
+        self.voicings1 = voicings1
+        self.voicings2 = voicings2
+        self.checks = 0
+        self._arrays = (note_arrays(voicings1, len(beat1)),
+                        note_arrays(voicings2, len(beat2)))
+        self._position = {var: (0, j) for j, var in enumerate(beat1)}
+        self._position.update({var: (1, j) for j, var in enumerate(beat2)})
+
+    @property
+    def shape(self) -> tuple:
+        return (len(self.voicings1), len(self.voicings2))
+
+    def matrix(self, constraints) -> np.ndarray:
+        """Returns the compatibility matrix of all the constraints"""
+        compatible = np.ones(self.shape, dtype=bool)
+        for con in constraints:
+            if not compatible.any():
+                break
+            compatible &= self.constraint_matrix(con)
+        return compatible
+
+    def constraint_matrix(self, con) -> np.ndarray:
+        """Returns the compatibility matrix of one constraint"""
+        if any(var not in self._position for var in con.scope):
+            raise ValueError(f'{con} is not within the two beats')
+
+        vectorized = VECTORIZED.get(con.condition)
+        if vectorized is not None:
+            self.checks += self.shape[0] * self.shape[1]
+            result = vectorized(*(self.column(var) for var in con.scope))
+            return np.broadcast_to(result, self.shape)
+
+        if con.condition in QUARTET_DECOMPOSITIONS:
+            return self.matrix(decompose([con]))
+
+        if isinstance(con.condition, Conjunction):
+            return self.matrix([
+                Constraint(con.scope, condition, con.cache)
+                for condition in con.condition.conditions
+            ])
+
+        beat_conditions = getattr(con.condition, 'beat_conditions', None)
+        half = len(con.scope) // 2
+        if beat_conditions is not None and \
+                all(self._position[var][0] == 0 for var in con.scope[:half]) \
+                and all(self._position[var][0] == 1
+                        for var in con.scope[half:]):
+            first = self.voicing_vector(beat_conditions[0], con.scope[:half],
+                                        self.voicings1)
+            second = self.voicing_vector(beat_conditions[1],
+                                         con.scope[half:], self.voicings2)
+            return first[:, None] & second[None, :]
+
+        # Opaque condition: evaluate it on every pair
+        self.checks += self.shape[0] * self.shape[1]
+        result = np.empty(self.shape, dtype=bool)
+        for i, voicing1 in enumerate(self.voicings1):
+            env = dict(zip(self.beat1, voicing1))
+            for j, voicing2 in enumerate(self.voicings2):
+                env.update(zip(self.beat2, voicing2))
+                result[i, j] = con.holds(env)
+        return result
+
+    def column(self, var) -> tuple:
+        """Returns the (midi, step) arrays of var, shaped to broadcast"""
+        beat, j = self._position[var]
+        midi, step = self._arrays[beat]
+        if beat == 0:
+            return midi[:, j, None], step[:, j, None]
+        return midi[None, :, j], step[None, :, j]
+
+    def voicing_vector(self, condition, scope, voicings) -> np.ndarray:
+        """Returns condition evaluated on each voicing, as a boolean vector"""
+        self.checks += len(voicings)
+        columns = [self._position[var][1] for var in scope]
+        return np.fromiter(
+            (condition(*(voicing[j] for j in columns)) for voicing in voicings),
+            dtype=bool,
+            count=len(voicings))
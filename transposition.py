@@ -0,0 +1,162 @@
+"""Solving harmonizations in one canonical key per mode
+
+All the rules of the SimpleHarmonizerCSP are invariant under transposition
+by a spelled interval, so a progression in any key can be solved in C (in
+the same mode), and the solution transposed back to the key. The canonical
+CSP has the part ranges transposed to C, so its solution transposed back
+stays within the ranges of the key; it is still checked, and the
+progression is solved in its own key if it does not.
+
+The transposed ranges differ from key to key, but all of them lie within
+the original ranges widened by a tritone each way. The canonical CSPs
+filter their voicings from the voicing tables of those widened ranges, and
+their solutions are cached under the canonical problem with the widened
+ranges, so both are shared by every key. A cached solution is used for
+another key when it transposes into that key's ranges.
+"""
+from pitches import as_note_value, note_value, transpose
+from solutions import problem_key
+from theory import Key
+
+CANONICAL_TONIC = 'C'
+
+
+def canonical_key(key) -> Key:
+    """Returns the key with the canonical tonic and the mode of key"""
+    return Key(CANONICAL_TONIC, key.mode)
+
+
+def key_interval(key) -> tuple:
+    """Returns the spelled interval from the canonical tonic to the tonic of key
+
+    The interval is the one of at most a fourth up or down, so C to A is a
+    minor third down.
+
+    Returns:
+        A (steps, semitones) tuple
+    """
+    tonic = note_value(key.tonic.name, 4)
+    canonical = note_value(CANONICAL_TONIC, 4)
+    steps = tonic.step - canonical.step
+    semitones = tonic.midi - canonical.midi
+    if steps > 3:
+        steps, semitones = steps - 7, semitones - 12
+    return steps, semitones
+
+
+def widened_ranges(ranges) -> dict:
+    """Returns the ranges widened by a tritone each way
+
+    They contain the ranges transposed to the canonical key from any key.
+    """
+    return {
+        p: (transpose(as_note_value(bottom), -3, -6),
+            transpose(as_note_value(top), 3, 6))
+        for p, (bottom, top) in ranges.items()
+    }
+
+
+def transpose_solution(solution: dict, steps: int, semitones: int) -> dict:
+    """Transposes every value of a {variable : NoteValue} solution"""
+    return {
+        var: transpose(value, steps, semitones)
+        for var, value in solution.items()
+    }
+
+
+def within_ranges(csp, solution: dict) -> bool:
+    """Returns True if every note of the solution is in the range of its part"""
+    for p, variables in csp.parts.items():
+        bottom, top = (as_note_value(note).midi for note in csp.ranges[p])
+        if any(not bottom <= solution[var].midi <= top for var in variables):
+            return False
+    return True
+
+
+class KeyNormalizer:
+    """Solves SimpleHarmonizerCSPs through their canonical key
+
+    Attributes:
+        solve_csp: The function from a CSP to its solution (a {variable :
+            NoteValue} dictionary or False)
+        cache: An optional SolutionCache for the solutions of the CSPs
+        transposed: The number of CSPs solved by transposing a solution of
+            the canonical key (by a unison in the canonical key itself)
+        shared: The number of those whose canonical solution was found in
+            the cache (usually stored by a CSP in another key)
+        fallbacks: The number of CSPs that had to be solved in their own key
+    """
+    def __init__(self, solve, cache=None):
+        self.solve_csp = solve
+        self.cache = cache
+        self.transposed = 0
+        self.shared = 0
+        self.fallbacks = 0
+
+    def _transpose_back(self, csp, solution, steps, semitones):
+        """Returns the canonical solution transposed into the ranges of csp
+
+        It is transposed by the interval of the key, then by the same
+        interval in the other direction, and None is returned if neither
+        is within the part ranges.
+        """
+        other = (steps - 7, semitones - 12) if steps >= 0 else \
+            (steps + 7, semitones + 12)
+        for interval in ((steps, semitones), other):
+            transposed = transpose_solution(solution, *interval)
+            if within_ranges(csp, transposed):
+                return transposed
+        return None
+
+    def solve(self, csp):
+        """Returns a solution of csp, or False if there is none
+
+        A cached canonical solution is used if it transposes into the ranges
+        of csp. Otherwise the canonical CSP is solved, and its solution is
+        cached for the other keys. A progression without a solution is
+        cached under its own problem, since its canonical CSP only has no
+        solution within the ranges of this key.
+        """
+        steps, semitones = key_interval(csp.key)
+        key = canonical_key(csp.key)
+        ranges = widened_ranges(csp.ranges)
+        shared = found = None
+        if self.cache is not None:
+            shared = problem_key(csp, key, ranges)
+            found, solution = self.cache.get(shared)
+            if found:
+                transposed = self._transpose_back(csp, solution, steps,
+                                                  semitones)
+                if transposed is not None:
+                    self.cache.hits += 1
+                    self.transposed += 1
+                    self.shared += 1
+                    return transposed
+            found_own, solution = self.cache.get(problem_key(csp))
+            if found_own:
+                self.cache.hits += 1
+                return solution
+            self.cache.misses += 1
+
+        if steps == 0 and semitones == 0:
+            canonical = csp
+        else:
+            canonical = csp.transposed(key, table_ranges=ranges)
+        solution = self.solve_csp(canonical)
+        if not solution:
+            if self.cache is not None:
+                self.cache.put(problem_key(csp), solution)
+            return solution
+
+        transposed = self._transpose_back(csp, solution, steps, semitones)
+        if transposed is not None:
+            if shared is not None and not found:
+                self.cache.put(shared, solution)
+            self.transposed += 1
+            return transposed
+
+        self.fallbacks += 1
+        solution = self.solve_csp(csp)
+        if self.cache is not None:
+            self.cache.put(problem_key(csp), solution)
+        return solution
@@ -1,4 +1,3 @@
-import music21 as m
 import copy
 
 # ______________________________________________________________________________
@@ -9,6 +8,7 @@ def play(x):
     """Returns nothing. Outputs a midi realization of x, a note or stream.
     Primarily for use in notebooks and web environments.
     """
+    import music21 as m
     if isinstance(x, m.stream.Stream):
         x = copy.deepcopy(x)
         for subStream in x.recurse(streamsOnly=True, includeSelf=True):
@@ -46,9 +46,6 @@ def first(iterable, default=None):
 
 def extend(s, var, val):
     """Copy dict s and extend it by setting var to val; return copy."""
-    try:  # Python 3.5 and later
-        return eval('{**s, var: val}')
-    except SyntaxError:  # Python 3.4
-        s2 = s.copy()
-        s2[var] = val
-        return s2
\ No newline at end of file
+    s2 = s.copy()
+    s2[var] = val
+    return s2
\ No newline at end of file
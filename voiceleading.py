@@ -0,0 +1,151 @@
+"""Integer voice-leading kernel
+
+Decides parallel fifths and octaves from the MIDI numbers and diatonic
+steps of NoteValues, without building music21 VoiceLeadingQuartets. The
+results are the same as VoiceLeadingQuartet.parallelFifth and
+parallelOctave (see test_voiceleading.py), including the spelling of the
+intervals and antiparallel motion.
+
+The *_array functions apply the same rules elementwise to NumPy arrays of
+MIDI numbers and steps, broadcasting like any NumPy operation.
+"""
+import numpy as np
+
+
+def _is_fifth(steps: int, semitones: int) -> bool:
+    """Returns True if the interval is a (possibly compound) perfect fifth
+
+    Args:
+        steps: The number of diatonic steps of the interval
+        semitones: The number of semitones of the interval
+    """
+    if steps < 0:
+        steps, semitones = -steps, -semitones
+    return steps % 7 == 4 and semitones == steps // 7 * 12 + 7
+
+
+def _is_octave(steps: int, semitones: int) -> bool:
+    """Returns True if the interval is a (possibly compound) perfect octave"""
+    if steps < 0:
+        steps, semitones = -steps, -semitones
+    return steps != 0 and steps % 7 == 0 and semitones == steps // 7 * 12
+
+
+def _is_unison_or_octave(steps: int, semitones: int) -> bool:
+    """Returns True if the interval is a perfect unison or (compound) octave"""
+    if steps < 0:
+        steps, semitones = -steps, -semitones
+    return steps % 7 == 0 and semitones == steps // 7 * 12
+
+
+def _sign(x: int) -> int:
+    return (x > 0) - (x < 0)
+
+
+def _motion(v1n1, v1n2, v2n1, v2n2) -> int:
+    """Classifies the motion of two voices
+
+    Returns:
+        1 for similar (or parallel) motion, -1 for contrary motion and 0
+        for no motion or oblique motion
+    """
+    still1 = v1n1.step == v1n2.step and v1n1.midi == v1n2.midi
+    still2 = v2n1.step == v2n2.step and v2n1.midi == v2n2.midi
+    if still1 and still2:
+        return 0
+    direction1 = _sign(v1n2.midi - v1n1.midi)
+    direction2 = _sign(v2n2.midi - v2n1.midi)
+    if direction1 == direction2:
+        return 1
+    if still1 or still2:
+        return 0
+    return -1
+
+
+def parallel_fifth(v1n1, v1n2, v2n1, v2n2) -> bool:
+    """Returns True if the voices move in parallel or antiparallel fifths
+
+    Args:
+        v1n1: First note of the first voice
+        v1n2: Second note of the first voice
+        v2n1: First note of the second voice
+        v2n2: Second note of the second voice
+    """
+    return (_is_fifth(v2n1.step - v1n1.step, v2n1.midi - v1n1.midi)
+            and _is_fifth(v2n2.step - v1n2.step, v2n2.midi - v1n2.midi)
+            and _motion(v1n1, v1n2, v2n1, v2n2) != 0)
+
+
+def parallel_octave(v1n1, v1n2, v2n1, v2n2) -> bool:
+    """Returns True if the voices move in parallel or antiparallel octaves
+
+    Antiparallel motion between unisons and octaves also counts, as it does
+    for VoiceLeadingQuartet.parallelOctave.
+
+    Args:
+        v1n1: First note of the first voice
+        v1n2: Second note of the first voice
+        v2n1: First note of the second voice
+        v2n2: Second note of the second voice
+    """
+    steps1 = v2n1.step - v1n1.step
+    semitones1 = v2n1.midi - v1n1.midi
+    steps2 = v2n2.step - v1n2.step
+    semitones2 = v2n2.midi - v1n2.midi
+    if not (_is_unison_or_octave(steps1, semitones1)
+            and _is_unison_or_octave(steps2, semitones2)):
+        return False
+    motion = _motion(v1n1, v1n2, v2n1, v2n2)
+    if motion == 1:
+        return _is_octave(steps1, semitones1) and _is_octave(
+            steps2, semitones2)
+    return motion == -1
+
+
+def _is_fifth_array(steps, semitones):
+    """Elementwise _is_fifth"""
+    sign = np.where(steps < 0, -1, 1)
+    steps, semitones = steps * sign, semitones * sign
+    return (steps % 7 == 4) & (semitones == steps // 7 * 12 + 7)
+
+
+def _is_octave_array(steps, semitones):
+    """Elementwise _is_octave"""
+    sign = np.where(steps < 0, -1, 1)
+    steps, semitones = steps * sign, semitones * sign
+    return (steps != 0) & (steps % 7 == 0) & (semitones == steps // 7 * 12)
+
+
+def _is_unison_or_octave_array(steps, semitones):
+    """Elementwise _is_unison_or_octave"""
+    sign = np.where(steps < 0, -1, 1)
+    steps, semitones = steps * sign, semitones * sign
+    return (steps % 7 == 0) & (semitones == steps // 7 * 12)
+
+
+def _motion_array(v1n1, v1n2, v2n1, v2n2):
+    """Elementwise _motion of notes given as (midi, step) pairs of arrays"""
+    still1 = (v1n1[1] == v1n2[1]) & (v1n1[0] == v1n2[0])
+    still2 = (v2n1[1] == v2n2[1]) & (v2n1[0] == v2n2[0])
+    similar = np.sign(v1n2[0] - v1n1[0]) == np.sign(v2n2[0] - v2n1[0])
+    return np.where(still1 & still2, 0,
+                    np.where(similar, 1, np.where(still1 | still2, 0, -1)))
+
+
+def parallel_fifth_array(v1n1, v1n2, v2n1, v2n2):
+    """Elementwise parallel_fifth of notes given as (midi, step) pairs of arrays"""
+    return (_is_fifth_array(v2n1[1] - v1n1[1], v2n1[0] - v1n1[0])
+            & _is_fifth_array(v2n2[1] - v1n2[1], v2n2[0] - v1n2[0])
+            & (_motion_array(v1n1, v1n2, v2n1, v2n2) != 0))
+
+
+def parallel_octave_array(v1n1, v1n2, v2n1, v2n2):
+    """Elementwise parallel_octave of notes given as (midi, step) pairs of arrays"""
+    steps1, semitones1 = v2n1[1] - v1n1[1], v2n1[0] - v1n1[0]
+    steps2, semitones2 = v2n2[1] - v1n2[1], v2n2[0] - v1n2[0]
+    motion = _motion_array(v1n1, v1n2, v2n1, v2n2)
+    octaves = _is_octave_array(steps1, semitones1) & _is_octave_array(
+        steps2, semitones2)
+    return (_is_unison_or_octave_array(steps1, semitones1)
+            & _is_unison_or_octave_array(steps2, semitones2)
+            & (((motion == 1) & octaves) | (motion == -1)))
@@ -0,0 +1,205 @@
+"""Precomputed tables of the valid voicings of a chord
+
+A voicing table lists every vertical voicing of a roman numeral in a key,
+for given part ranges, that satisfies the one-beat constraints of the
+SimpleHarmonizerCSP (the bass plays the bass of the chord, all notes are
+different and the root and third are present). Tables are cached in memory
+by (numeral, key, ranges, part_list) and can be saved to a file.
+"""
+import gzip
+import itertools
+import os
+import pickle
+from constraints import (CONSTRAINT_SET_VERSION,
+                         all_notes_different_one_beat, require_root_and_third)
+from pitches import note_value, as_note_value, parse_note_value
+from theory import Numeral, parse_numeral
+
+# Version of the table file format and of the numeral parsing the tables are
+# built from. Bump it whenever theory.parse_numeral can change the notes of a
+# chord, so that saved tables are not reused
+TABLES_VERSION = 2
+
+
+def notes_from_roman(bottom, top, rn):
+    """Generate all possible not for a range that are in a roman numeral
+
+    Args:
+        bottom: The lowest note of the range (a Note or a NoteValue)
+        top: The highest note of the range (a Note or a NoteValue)
+        rn: The Numeral of the chord
+
+    Returns:
+        A list of NoteValues in the range that belong to the chord
+    """
+    bottom = as_note_value(bottom)
+    top = as_note_value(top)
+    possible_notes = list(rn.names)
+
+    all_notes = []
+    octave = bottom.octave
+    while octave <= top.octave:
+        for n in possible_notes:
+            actual_note = note_value(n, octave)
+            if bottom.midi <= actual_note.midi <= top.midi:
+                all_notes.append(actual_note)
+        octave += 1
+
+    return all_notes
+
+
+def in_range(value, bottom, top) -> bool:
+    """Returns True if notes_from_roman lists value for the range
+
+    Like notes_from_roman, only the octaves from the one of bottom to the
+    one of top are in the range, so B#3 is not in a range from C4.
+    """
+    return bottom.octave <= value.octave <= top.octave and \
+        bottom.midi <= value.midi <= top.midi
+
+
+def bass_notes_from_roman(bass_note_list, rn):
+    """Returns a list of the possible bass notes given a rn.
+
+    Use to restrict the domain of the bottom voice to only the bass of
+    the chord for the roman numeral
+    """
+    b = rn.bass
+    return list(filter(lambda n: n.name == b, bass_note_list))
+
+
+def key_name(key) -> str:
+    """Returns a canonical name for a Key, like 'E major'"""
+    return f'{key.tonic.name} {key.mode}'
+
+
+def range_names(ranges, part_list) -> tuple:
+    """Returns the ranges of the parts as a tuple of note name pairs"""
+    return tuple((as_note_value(ranges[p][0]).nameWithOctave,
+                  as_note_value(ranges[p][1]).nameWithOctave)
+                 for p in part_list)
+
+
+class VoicingTables:
+    """A cache of voicing tables, optionally backed by a file
+
+    On disk each table is stored as the names of the values of each part and
+    one byte per part and voicing indexing into them, in a gzipped pickle
+    with TABLES_VERSION and CONSTRAINT_SET_VERSION. A file saved with other
+    versions is ignored. Only load files you trust, since unpickling can
+    run arbitrary code.
+
+    Attributes:
+        path: The file the tables are loaded from and saved to, or None
+        hits: The number of tables found in the cache
+        misses: The number of tables computed
+    """
+    def __init__(self, path=None):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._tables = {}
+        self._numerals = {}
+        if path is not None and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._tables)
+
+    def roman(self, numeral: str, key) -> Numeral:
+        """Returns the Numeral for a numeral in a key, parsed once"""
+        cache_key = (numeral, key_name(key))
+        rn = self._numerals.get(cache_key)
+        if rn is None:
+            rn = self._numerals[cache_key] = parse_numeral(numeral, key)
+        return rn
+
+    def get(self, numeral: str, key, ranges, part_list, within=None) -> tuple:
+        """Returns the valid voicings of a chord
+
+        Args:
+            numeral: The roman numeral of the chord (as a string)
+            key: The Key of the chord
+            ranges: A dictionary mapping parts to a tuple of their range
+            part_list: The parts, from the top voice to the bass
+            within: Narrower ranges to keep the voicings of, or None for all
+                of them. The table of ranges is cached, so CSPs with
+                different ranges inside the same ones share it.
+
+        Returns:
+            A tuple of voicings, each a tuple of NoteValues in the order
+            of part_list
+        """
+        cache_key = (numeral, key_name(key), range_names(ranges, part_list),
+                     tuple(part_list))
+        table = self._tables.get(cache_key)
+        if table is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            table = self._tables[cache_key] = self.compute(
+                self.roman(numeral, key), ranges, part_list)
+        if within is None:
+            return table
+        bounds = [tuple(as_note_value(note) for note in within[p])
+                  for p in part_list]
+        return tuple(
+            voicing for voicing in table
+            if all(in_range(value, *bound)
+                   for value, bound in zip(voicing, bounds)))
+
+    def compute(self, rn: Numeral, ranges, part_list) -> tuple:
+        """Enumerates the valid voicings of the chord of rn"""
+        candidates = []
+        for p in part_list:
+            notes = notes_from_roman(*ranges[p], rn)
+            if p == part_list[-1]:
+                notes = bass_notes_from_roman(notes, rn)
+            candidates.append(notes)
+        root_and_third = require_root_and_third(rn)
+        return tuple(
+            voicing for voicing in itertools.product(*candidates)
+            if all_notes_different_one_beat(*voicing)
+            and root_and_third(*voicing))
+
+    def load(self):
+        """Adds the tables saved in self.path to the cache
+
+        Nothing is added if they were saved with other versions. The file is
+        unpickled, so it must come from a trusted source.
+        """
+        with gzip.open(self.path, 'rb') as f:
+            stored = pickle.load(f)
+        if not isinstance(stored, dict) or stored.get('version') != (
+                TABLES_VERSION, CONSTRAINT_SET_VERSION):
+            return
+        for cache_key, (names, rows) in stored['tables'].items():
+            values = [[parse_note_value(n) for n in part] for part in names]
+            width = len(values)
+            self._tables[cache_key] = tuple(
+                tuple(values[j][rows[i + j]] for j in range(width))
+                for i in range(0, len(rows), width))
+
+    def save(self, path=None):
+        """Writes the cached tables to path (self.path if not given)"""
+        path = path or self.path
+        stored = {}
+        for cache_key, table in self._tables.items():
+            width = len(cache_key[3])
+            values = [sorted({v[j] for v in table}) for j in range(width)]
+            index = [{val: i for i, val in enumerate(part)} for part in values]
+            rows = bytes(index[j][v[j]] for v in table for j in range(width))
+            names = [[val.nameWithOctave for val in part] for part in values]
+            stored[cache_key] = (names, rows)
+        tmp_path = f'{path}.tmp'
+        with gzip.open(tmp_path, 'wb') as f:
+            pickle.dump(
+                {
+                    'version': (TABLES_VERSION, CONSTRAINT_SET_VERSION),
+                    'tables': stored
+                }, f)
+        os.replace(tmp_path, path)
+
+
+# Shared by all CSPs that are not given their own tables
+default_tables = VoicingTables()
@@ -0,0 +1,94 @@
+"""Worklist of arcs for GAC
+
+Arcs are (variable, constraint) pairs. They are kept in FIFO buckets keyed
+by an integer priority (the arity of the constraint by default), with a
+dirty flag per arc so that membership tests, re-adding an arc that is
+already queued and discarding one are O(1).
+"""
+from collections import deque
+
+
+def arity(arc) -> int:
+    """Priority of an arc by the size of its constraint's scope"""
+    return len(arc[1].scope)
+
+
+class ArcWorklist:
+    """Arcs to revise, popped lowest priority first
+
+    Attributes:
+        priority: A function from an arc to an int; lower is popped first
+        dirty: A {arc : bool} dictionary. An arc is dirty (and queued) from
+            when it is added until it is popped to be revised or discarded.
+            Discarded arcs stay in their bucket and are skipped when popped.
+    """
+    def __init__(self, arcs=(), priority=arity):
+        self.priority = priority
+        self.dirty = {}
+        self._buckets = {}
+        self._keys = []
+        self._priorities = {}
+        self._size = 0
+        self.update(arcs)
+
+    def __len__(self):
+        return self._size
+
+    def __bool__(self):
+        return self._size > 0
+
+    def __contains__(self, arc):
+        return self.dirty.get(arc, False)
+
+    def __iter__(self):
+        seen = set()
+        for key in self._keys:
+            for arc in self._buckets[key]:
+                if self.dirty[arc] and arc not in seen:
+                    seen.add(arc)
+                    yield arc
+
+    def add(self, arc):
+        """Queues arc unless it is already queued"""
+        if self.dirty.get(arc, False):
+            return
+        self.dirty[arc] = True
+        key = self._priorities.get(arc)
+        if key is None:
+            key = self._priorities[arc] = self.priority(arc)
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = deque()
+            self._keys.append(key)
+            self._keys.sort()
+        bucket.append(arc)
+        self._size += 1
+
+    def update(self, arcs):
+        """Queues every arc of arcs"""
+        for arc in arcs:
+            self.add(arc)
+
+    def discard(self, arc):
+        """Unqueues arc if it is queued"""
+        if self.dirty.get(arc, False):
+            self.dirty[arc] = False
+            self._size -= 1
+
+    def pop(self):
+        """Removes and returns the oldest arc of the lowest priority"""
+        for key in self._keys:
+            bucket = self._buckets[key]
+            while bucket:
+                arc = bucket.popleft()
+                if not self.dirty[arc]:
+                    # Discarded
+                    continue
+                self.dirty[arc] = False
+                self._size -= 1
+                return arc
+        raise KeyError('pop from an empty ArcWorklist')
+
+    def copy(self):
+        """Returns a new worklist with the same queued arcs and priority"""
+        return ArcWorklist(self, self.priority)